@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for cert-inspection, run against a fleet of local TLS servers so the numbers do not
+depend on the network or on anyone else's servers.
+
+Synthetic CA hierarchies (root -> intermediate -> leaf) are generated for each scenario:
+    root_in_chain   the server sends leaf, intermediate and root
+    root_missing    the server sends leaf and intermediate; the root comes from the trust store
+    ski_less_root   as root_missing, but the root has no subject key identifier, so it is
+                    found in the trust store by DN
+The synthetic roots are added to the in-memory trust store and to a copy of the default CA bundle
+used for verification.  The servers run in a separate process, so their CPU does not compete
+with the scanner's.
+
+Measured:
+    process         latency of process() per scenario, with the median of each timing phase
+    throughput      scans per second through bulk (threads) and async engines at several concurrencies
+    lambda          lambda_handler end-to-end, uncached (nocache) and from the result cache
+    parse           get_cert_details() cost, uncached (parse_cert_details) and from the cache
+    cold_start      python start + import main, trust store load and context creation, in a fresh process
+
+The results are written as json (stdout, or -o file), and --compare prints the change from an
+earlier run's json.
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import datetime
+import platform
+import tempfile
+import statistics
+import subprocess
+import multiprocessing
+import concurrent.futures
+import ssl
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+from OpenSSL import crypto
+
+import main
+
+THISFILE=os.path.abspath(__file__)
+CWD=os.path.dirname(THISFILE)
+
+SCENARIOS=['root_in_chain', 'root_missing', 'ski_less_root']
+SERVERNAME="localhost"
+
+def make_key(key_type: str):
+    if key_type == "rsa":
+        return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    return ec.generate_private_key(ec.SECP256R1())
+
+def make_cert(cn: str, key, issuer_cert=None, issuer_key=None, ca: bool = False, ski: bool = True, days: int = 365):
+    """A cert for cn, signed by issuer_key (self-signed if not given)"""
+    subject = x509.Name([x509.NameAttribute(NameOID.ORGANIZATION_NAME, "cert-inspection benchmark"),
+                         x509.NameAttribute(NameOID.COMMON_NAME, cn)])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    builder = (x509.CertificateBuilder()
+        .subject_name(subject)
+        .issuer_name(issuer_cert.subject if issuer_cert else subject)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=days))
+        .add_extension(x509.BasicConstraints(ca=ca, path_length=None), critical=True))
+    if ski:
+        builder = builder.add_extension(x509.SubjectKeyIdentifier.from_public_key(key.public_key()), critical=False)
+    if issuer_key:
+        builder = builder.add_extension(x509.AuthorityKeyIdentifier.from_issuer_public_key(issuer_key.public_key()), critical=False)
+    if ca:
+        builder = builder.add_extension(x509.KeyUsage(digital_signature=True, content_commitment=False, key_encipherment=False,
+            data_encipherment=False, key_agreement=False, key_cert_sign=True, crl_sign=True, encipher_only=False,
+            decipher_only=False), critical=True)
+    else:
+        builder = builder.add_extension(x509.SubjectAlternativeName([x509.DNSName(SERVERNAME)]), critical=False)
+        builder = builder.add_extension(x509.ExtendedKeyUsage([x509.oid.ExtendedKeyUsageOID.SERVER_AUTH]), critical=False)
+    return builder.sign(issuer_key or key, hashes.SHA256())
+
+def pem(cert):
+    return cert.public_bytes(serialization.Encoding.PEM)
+
+def make_scenario(name: str, key_type: str, workdir: str):
+    """Generate the hierarchy for a scenario, writing the server's chain and key files
+    Returns a dict with the root cert and the server's chain and key file names.
+    """
+    root_key = make_key(key_type)
+    root = make_cert(f"{name} root", root_key, ca=True, ski=(name != 'ski_less_root'), days=3650)
+    intermediate_key = make_key(key_type)
+    intermediate = make_cert(f"{name} intermediate", intermediate_key, root, root_key, ca=True, days=1825)
+    leaf_key = make_key(key_type)
+    leaf = make_cert(SERVERNAME, leaf_key, intermediate, intermediate_key)
+
+    chain = pem(leaf) + pem(intermediate)
+    if name == 'root_in_chain':
+        chain += pem(root)
+    with open(f"{workdir}/{name}.chain.pem", "wb") as f:
+        f.write(chain)
+    with open(f"{workdir}/{name}.key.pem", "wb") as f:
+        f.write(leaf_key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()))
+    return {'root': root, 'leaf': leaf, 'chain': f"{workdir}/{name}.chain.pem", 'key': f"{workdir}/{name}.key.pem"}
+
+def trust_roots(roots, workdir: str):
+    """Trust the synthetic roots: add them to the in-memory trust store, and to a copy
+    of the default CA bundle for verification.  Returns the bundle's file name.
+    """
+    store = main.get_trust_store()
+    for root in roots:
+        cert = crypto.load_certificate(crypto.FILETYPE_PEM, pem(root))
+        details = main.trusted_root_details(cert)
+        # keyed as main.load_trust_index() keys them: by SKI, or by DN if there is none
+        if 'subjectKeyIdentifier' in details:
+            store[details['subjectKeyIdentifier']] = details
+        else:
+            store[details['serialized_subject']] = details
+
+    cafile = f"{workdir}/cacert.pem"
+    with open(main.default_cafile(), "rb") as f:
+        bundle = f.read()
+    with open(cafile, "wb") as f:
+        f.write(bundle + b"".join(pem(root) for root in roots))
+    return cafile
+
+def run_servers(servers, ports):
+    """Child process: serve each (chain, key) on its own loopback port, putting the ports on the queue"""
+    async def handle(reader, writer):
+        try:
+            await reader.read(1) # until the client closes
+        except Exception:
+            pass
+        writer.close()
+
+    async def serve():
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: None) # quiet aborted handshakes
+        listening = []
+        for chain, key in servers:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(chain, key)
+            server = await asyncio.start_server(handle, "127.0.0.1", 0, ssl=context, backlog=4096)
+            listening.append(server)
+            ports.put(server.sockets[0].getsockname()[1])
+        await asyncio.Event().wait()
+
+    asyncio.run(serve())
+
+def start_fleet(scenarios: dict, per_scenario: int):
+    """Start the server process, returning it and a dict of scenario -> list of ports"""
+    servers = []
+    for name, scenario in scenarios.items():
+        servers += [(scenario['chain'], scenario['key'])] * per_scenario
+    ports = multiprocessing.Queue()
+    process = multiprocessing.Process(target=run_servers, args=(servers, ports), daemon=True)
+    process.start()
+    fleet = {}
+    for name in scenarios:
+        fleet[name] = [ports.get(timeout=30) for i in range(per_scenario)]
+    return process, fleet
+
+def summarize(samples):
+    """Latency statistics, in milliseconds, for a list of samples in seconds"""
+    samples = sorted(samples)
+    def pct(p):
+        return round(samples[min(len(samples) - 1, int(len(samples) * p))] * 1000, 3)
+    return {
+        'count': len(samples),
+        'mean': round(statistics.mean(samples) * 1000, 3),
+        'p50': pct(0.50),
+        'p95': pct(0.95),
+        'p99': pct(0.99),
+        'max': round(samples[-1] * 1000, 3)
+    }
+
+def bench_process(ports, iterations: int, cafile: str):
+    """Sequential process() latency, plus the median of each timing phase"""
+    samples = []
+    phases = {}
+    for i in range(iterations):
+        start = time.perf_counter()
+        results = main.process("127.0.0.1", ports[i % len(ports)], SERVERNAME, cafile=cafile)
+        samples.append(time.perf_counter() - start)
+        for phase, ms in results['timing'].items():
+            phases.setdefault(phase, []).append(ms)
+    summary = summarize(samples)
+    summary['phases_p50'] = {phase: round(statistics.median(values), 3) for phase, values in phases.items()}
+    summary['certs'] = len(results['certs'])
+    summary['trusted_root_added'] = not results['certs'][len(results['certs']) - 1]['fromServer']
+    return summary
+
+def bench_threads(ports, concurrency: int, count: int, cafile: str):
+    """process() throughput on a pool of concurrency threads"""
+    def scan(i):
+        start = time.perf_counter()
+        main.process("127.0.0.1", ports[i % len(ports)], SERVERNAME, cafile=cafile)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        samples = list(executor.map(scan, range(count)))
+    elapsed = time.perf_counter() - start
+    summary = summarize(samples)
+    summary['per_second'] = round(count / elapsed, 1)
+    return summary
+
+def bench_async(ports, concurrency: int, count: int, cafile: str):
+    """process_async() throughput with concurrency handshakes in flight"""
+    async def run():
+        limits = main.ScanLimits(concurrency, concurrency)
+        async def scan(i):
+            # time from getting a slot, as the thread pool does, rather than from being queued
+            async with limits.slot("127.0.0.1"):
+                start = time.perf_counter()
+                await main.process_async("127.0.0.1", ports[i % len(ports)], SERVERNAME, cafile=cafile)
+                return time.perf_counter() - start
+        return await asyncio.gather(*[scan(i) for i in range(count)])
+
+    start = time.perf_counter()
+    samples = asyncio.run(run())
+    elapsed = time.perf_counter() - start
+    summary = summarize(samples)
+    summary['per_second'] = round(count / elapsed, 1)
+    return summary
+
+def bench_lambda(port: int, iterations: int, cafile: str):
+    """lambda_handler end-to-end, uncached and from the result cache
+    lambda_handler verifies against default_cafile(), so that is pointed at
+    cafile for the duration, to verify the same chains as the other benchmarks.
+    """
+    results = {}
+    saved_cafile = main.default_cafile_name
+    main.default_cafile_name = cafile
+    try:
+        for label, extra in [('uncached', {'nocache': ''}), ('cached', {})]:
+            event = {'queryStringParameters': {'host': f"127.0.0.1:{port}", 'servername': SERVERNAME, **extra}}
+            main.lambda_handler(event, None)
+            samples = []
+            for i in range(iterations):
+                start = time.perf_counter()
+                main.lambda_handler(event, None)
+                samples.append(time.perf_counter() - start)
+            results[label] = summarize(samples)
+    finally:
+        main.default_cafile_name = saved_cafile
+    return results
+
+def bench_parse(cert, iterations: int):
+    """get_cert_details() cost for one cert, uncached and from the cache"""
+    results = {}
+    for label, function in [('uncached', main.parse_cert_details), ('cached', main.get_cert_details)]:
+        function(cert)
+        samples = []
+        for i in range(iterations):
+            start = time.perf_counter()
+            function(cert)
+            samples.append(time.perf_counter() - start)
+        results[label] = summarize(samples)
+    return results
+
+COLD_START_SCRIPT = """
+import time, json
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+main.get_trust_store()
+trust_loaded = time.perf_counter()
+main.get_context(main.default_cafile())
+context_ready = time.perf_counter()
+print(json.dumps({'import': imported - start, 'trust_store': trust_loaded - imported, 'context': context_ready - trust_loaded}))
+"""
+
+def bench_cold_start(runs: int):
+    """Cost of starting a fresh process: interpreter, import main, trust store, context"""
+    phases = {'process': []}
+    for i in range(runs):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, "-c", COLD_START_SCRIPT], cwd=CWD, capture_output=True, text=True, check=True).stdout
+        phases['process'].append(time.perf_counter() - start)
+        for phase, seconds in json.loads(output).items():
+            phases.setdefault(phase, []).append(seconds)
+    return {phase: summarize(samples) for phase, samples in phases.items()}
+
+def compare(old: dict, new: dict, path: str = ""):
+    """Print the change in every latency (p50, mean) and throughput (per_second) figure from old to new"""
+    for key, value in new.items():
+        if isinstance(value, dict):
+            if isinstance(old.get(key), dict):
+                compare(old[key], value, f"{path}{key}.")
+        elif key in ('p50', 'mean', 'per_second') and isinstance(old.get(key), (int, float)) and old[key]:
+            change = (value - old[key]) / old[key] * 100
+            print(f"{path}{key}: {old[key]} -> {value} ({change:+.1f}%)")
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix="cert-inspection-bench-")
+    scenarios = {name: make_scenario(name, args.key_type, workdir) for name in SCENARIOS}
+    cafile = trust_roots([scenario['root'] for scenario in scenarios.values()], workdir)
+    server_process, fleet = start_fleet(scenarios, args.servers)
+
+    try:
+        results = {
+            'meta': {
+                'time': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                'python': platform.python_version(),
+                'openssl': crypto.OpenSSL_version(crypto.OPENSSL_VERSION).decode('UTF-8') if hasattr(crypto, 'OpenSSL_version') else None,
+                'platform': platform.platform(),
+                'key_type': args.key_type,
+                'servers_per_scenario': args.servers,
+            },
+            'process': {},
+            'throughput': {'threads': {}, 'async': {}},
+        }
+        for name in SCENARIOS:
+            results['process'][name] = bench_process(fleet[name], args.iterations, cafile)
+
+        ports = fleet['root_missing']
+        for concurrency in args.concurrency:
+            count = max(args.throughput_scans, concurrency)
+            results['throughput']['threads'][str(concurrency)] = bench_threads(ports, concurrency, count, cafile)
+            results['throughput']['async'][str(concurrency)] = bench_async(ports, concurrency, count, cafile)
+
+        results['lambda'] = bench_lambda(ports[0], args.iterations, cafile)
+        leaf = crypto.load_certificate(crypto.FILETYPE_PEM, pem(scenarios['root_missing']['leaf']))
+        results['parse'] = bench_parse(leaf, args.iterations * 10)
+        results['cold_start'] = bench_cold_start(args.cold_starts)
+        results['caches'] = {
+            'cert_details': main.cert_details_cache.info(),
+            'dns': main.dns_cache.info(),
+            'result': main.result_cache.info(),
+        }
+    finally:
+        server_process.terminate()
+    return results
+
+def cli():
+    parser = argparse.ArgumentParser(description='cert-inspection benchmarks against local TLS servers')
+    parser.add_argument('-o','--output', help='Write the json results to this file (default stdout)', default=None)
+    parser.add_argument('--compare', help='Print the change from the json results of an earlier run', default=None)
+    parser.add_argument('-n','--iterations', help='Iterations for the latency benchmarks (default 200)', type=int, default=200)
+    parser.add_argument('--concurrency', help='Concurrency levels for the throughput benchmarks (default 1,8,32,128)', default="1,8,32,128")
+    parser.add_argument('--throughput-scans', help='Scans per throughput benchmark (default 500)', type=int, default=500)
+    parser.add_argument('--servers', help='TLS servers per scenario (default 4)', type=int, default=4)
+    parser.add_argument('--cold-starts', help='Fresh processes to time for the cold start benchmark (default 10)', type=int, default=10)
+    parser.add_argument('--key-type', help='Key type for the synthetic certs (default rsa)', choices=['rsa', 'ec'], default='rsa')
+    args = parser.parse_args()
+    args.concurrency = [int(c) for c in args.concurrency.split(",")]
+
+    results = run(args)
+
+    output = json.dumps(results, indent=4)
+    if args.output:
+        with open(args.output, "w", encoding="utf8") as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf8") as f:
+            compare(json.load(f), results)
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Discover the endpoints related to a domain by following the subjectAltName entries of the certs
+they present.  Starting from the seed hosts, each host is scanned, and every DNS name in its leaf
+cert's subjectAltName that is in scope and has not been seen yet is scanned at the next depth, up
+to --depth.  Wildcard names are skipped, since there is no host to connect to.
+
+Syntax:
+    ./crawl.py [-d <depth>] [-s <domain>] ... [-w <workers>] [--max-hosts <n>] <seed> ...
+
+A seed is "hostname[:port] [servername]" as for the main.py -b input, or "-" to read seeds from
+stdin.  Discovered hosts are scanned on the port of the host they were found from.  A name is in
+scope if it is one of the --scope domains or under one; by default the scope is the seed hosts.
+
+Every depth is scanned concurrently.  Most endpoints of an org share a handful of chains, so each
+chain (by the fingerprints of the certs the server sent) is written once, as a line of json with
+"chain" and "certs", before the first endpoint that presented it; endpoints are written as lines
+with "target", "depth", "from" (the host whose cert named it), "chain" and "results" (without the
+certs), or "error".  The SANs of a chain that was already seen (on the same port) are not looked
+at again, and the certs of a chain are parsed only once, through main.cert_details_cache.
+"""
+
+import sys
+import json
+import argparse
+import concurrent.futures
+
+import main
+
+DEPTH = 2
+WORKERS = 16
+MAX_HOSTS = 1000   # stop discovering once this many hosts have been queued
+
+# the crawl needs these, whatever details were asked for
+CRAWL_FIELDS = frozenset(['SHA-1 fingerprint', 'subjectAltName'])
+
+def san_names(cert: dict):
+    """The DNS names in a cert's subjectAltName, lowercased, in order"""
+    names = []
+    for entry in cert.get('subjectAltName', "").split(","):
+        entry = entry.strip()
+        if entry.startswith("DNS:"):
+            names.append(entry[4:].rstrip(".").lower())
+    return names
+
+def in_scope(hostname: str, scope):
+    """Whether hostname is one of the scope domains, or under one"""
+    return any(hostname == domain or hostname.endswith("." + domain) for domain in scope)
+
+def chain_fingerprints(results: dict):
+    """The fingerprints of the certs the server sent, leaf first"""
+    return tuple(cert['SHA-1 fingerprint'] for cert in results['certs'].values() if cert['fromServer'])
+
+def crawl(seeds, out=sys.stdout, depth: int = DEPTH, scope=None, workers: int = WORKERS, max_hosts: int = MAX_HOSTS, timeout: float = main.SCAN_TIMEOUT, fields: frozenset = None):
+    """Scan the seeds and the hosts named in their certs, depth by depth, writing NDJSON to out
+    Returns counts of the hosts scanned, the distinct chains, and the errors.
+    """
+    seeds = [main.parse_target(seed) for seed in seeds]
+    scope = [domain.strip(".").lower() for domain in (scope or [hostname for hostname, port, servername in seeds])]
+    scan_fields = fields and fields | CRAWL_FIELDS
+    visited = set()
+    chains = set()
+    expanded = set()   # (chain, port) whose SANs have been followed
+    counts = {'hosts': 0, 'chains': 0, 'errors': 0}
+
+    # (hostname, port, servername, found from)
+    frontier = []
+    for hostname, port, servername in seeds:
+        if (hostname.lower(), port) not in visited:
+            visited.add((hostname.lower(), port))
+            frontier.append((hostname, port, servername, None))
+
+    def scan(target):
+        hostname, port, servername, parent = target
+        try:
+            return main.process(hostname, port, servername, timeout=timeout, fields=scan_fields)
+        except Exception as exc:
+            return exc
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        for level in range(depth + 1):
+            if not frontier:
+                break
+            next_frontier = []
+            futures = {executor.submit(scan, target): target for target in frontier}
+            for future in concurrent.futures.as_completed(futures):
+                hostname, port, servername, parent = futures[future]
+                results = future.result()
+                counts['hosts'] += 1
+                record = {'target': f"{hostname}:{port}", 'depth': level, 'from': parent}
+                if servername != hostname:
+                    record['servername'] = servername
+                if isinstance(results, Exception):
+                    counts['errors'] += 1
+                    record['error'] = str(results)
+                    out.write(json.dumps(record) + "\n")
+                    continue
+
+                fingerprints = chain_fingerprints(results)
+                record['chain'] = list(fingerprints)
+                certs = results.pop('certs')
+                record['results'] = results
+                if fingerprints not in chains:
+                    chains.add(fingerprints)
+                    counts['chains'] += 1
+                    out.write(json.dumps({'chain': list(fingerprints), 'certs': certs}) + "\n")
+                if level < depth and (fingerprints, port) not in expanded:
+                    expanded.add((fingerprints, port))
+                    for name in san_names(certs[0]):
+                        if name.startswith("*.") or not in_scope(name, scope) or (name, port) in visited:
+                            continue
+                        if len(visited) >= max_hosts:
+                            break
+                        visited.add((name, port))
+                        next_frontier.append((name, port, name, hostname))
+                out.write(json.dumps(record) + "\n")
+            out.flush()
+            frontier = next_frontier
+    return counts
+
+def cli():
+    parser = argparse.ArgumentParser(description='Discover endpoints by following the subjectAltNames of their certs')
+    parser.add_argument('seeds', help='Hosts to start from, as hostname[:port] ("-" to read them from stdin)', nargs='+')
+    parser.add_argument('-d','--depth', help=f'How many steps to follow from the seeds (default {DEPTH})', type=int, default=DEPTH)
+    parser.add_argument('-s','--scope', help='Only follow names in or under this domain, may be repeated (default the seed hosts)', action='append', default=None)
+    parser.add_argument('-w','--workers', help=f'Concurrent scans (default {WORKERS})', type=int, default=WORKERS)
+    parser.add_argument('--max-hosts', help=f'Stop discovering after this many hosts (default {MAX_HOSTS})', type=int, default=MAX_HOSTS)
+    parser.add_argument('-t','--timeout', help=f'Seconds allowed for each scan (default {main.SCAN_TIMEOUT})', type=float, default=main.SCAN_TIMEOUT)
+    parser.add_argument('--fields', help='Comma separated list of the cert details to include', default=None)
+    parser.add_argument('--profile', help='Named set of cert details to include (summary or full)', default=None)
+    args = parser.parse_args()
+
+    seeds = []
+    for seed in args.seeds:
+        if seed == '-':
+            seeds.extend(main.read_targets(sys.stdin))
+        else:
+            seeds.append(seed)
+
+    counts = crawl(seeds, depth=args.depth, scope=args.scope, workers=args.workers, max_hosts=args.max_hosts,
+        timeout=args.timeout, fields=main.get_fields(args.fields, args.profile))
+    print(f"scanned {counts['hosts']} hosts, {counts['chains']} distinct chains, {counts['errors']} errors", file=sys.stderr)
+
+if __name__ == '__main__':
+    cli()
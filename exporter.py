@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Scan a list of targets on a schedule, and serve the results as OpenMetrics (Prometheus) metrics.
+
+Syntax:
+    ./exporter.py [-p <port>] [-i <interval>] [-w <workers>] <targets file>
+
+The targets file has the same format as the main.py -b input.  Every target is scanned through
+main.process() every --interval seconds, and http://<host>:<port>/metrics gives:
+    cert_inspection_scan_phase_seconds      histogram of the time in each phase of a scan (dns,
+                                            connect, handshake, parse, trust, total)
+    cert_inspection_scans_total             scans, by result (success or error)
+    cert_inspection_validations_total       certs validated, by VALIDATE_ERROR code
+    cert_inspection_cache_hits_total        hits and misses of main.py's caches, and their hit ratio
+    cert_inspection_cache_misses_total
+    cert_inspection_cache_hit_ratio
+    cert_inspection_days_to_expiry          days until the leaf cert's notAfter, by target
+    cert_inspection_scan_success            whether the last scan of a target succeeded
+
+Histograms have fixed buckets, and the only labels are the phase, the VALIDATE_ERROR code, the
+cache and the target, so the number of series is bounded by the targets file.
+"""
+
+import re
+import sys
+import time
+import bisect
+import argparse
+import threading
+import concurrent.futures
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import main
+import monitor
+
+PORT = 9117
+INTERVAL = 300    # seconds between scans of each target
+WORKERS = 16
+
+PREFIX = "cert_inspection"
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+# upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+PHASES = ['dns', 'connect', 'handshake', 'parse', 'trust', 'total']
+# codes in the validation strings from main.verify(), eg. "verify:depth:1 - 20: unable to get local issuer certificate"
+VALIDATION_CODE = re.compile(r" - (\d+): ")
+
+class Histogram:
+    """Counts of observations in fixed buckets, plus their count and sum"""
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last is +Inf
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def samples(self, name: str, labels: str):
+        """The bucket, count and sum sample lines, in OpenMetrics text format"""
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ["+Inf"], self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_count{{{labels}}} {cumulative}')
+        lines.append(f'{name}_sum{{{labels}}} {round(self.sum, 6)}')
+        return lines
+
+class Metrics:
+    """The metrics from every scan so far, updated under one lock"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.phases = {phase: Histogram(LATENCY_BUCKETS) for phase in PHASES}
+        self.scans = {'success': 0, 'error': 0}
+        self.validations = {}  # VALIDATE_ERROR code -> count
+        self.days = {}         # target -> days to the leaf's notAfter
+        self.success = {}      # target -> 1 if the last scan succeeded, else 0
+
+    def record_results(self, target: str, results: dict):
+        codes = [int(code) for cert in results['certs'].values() for code in VALIDATION_CODE.findall(cert.get('validation', ""))]
+        days = monitor.days_left(results['certs'][0]['notAfter'])
+        with self.lock:
+            for phase, histogram in self.phases.items():
+                if phase in results['timing']:
+                    histogram.observe(results['timing'][phase] / 1000)
+            self.scans['success'] += 1
+            for code in codes:
+                self.validations[code] = self.validations.get(code, 0) + 1
+            self.days[target] = days
+            self.success[target] = 1
+
+    def record_error(self, target: str):
+        with self.lock:
+            self.scans['error'] += 1
+            self.success[target] = 0
+
+    def render(self):
+        """The metrics in OpenMetrics text format"""
+        lines = []
+        with self.lock:
+            lines.append(f"# TYPE {PREFIX}_scan_phase_seconds histogram")
+            lines.append(f"# UNIT {PREFIX}_scan_phase_seconds seconds")
+            lines.append(f"# HELP {PREFIX}_scan_phase_seconds Time spent in each phase of a scan.")
+            for phase, histogram in self.phases.items():
+                lines.extend(histogram.samples(f"{PREFIX}_scan_phase_seconds", f'phase="{phase}"'))
+
+            lines.append(f"# TYPE {PREFIX}_scans counter")
+            lines.append(f"# HELP {PREFIX}_scans Scans, by result.")
+            for result, count in self.scans.items():
+                lines.append(f'{PREFIX}_scans_total{{result="{result}"}} {count}')
+
+            lines.append(f"# TYPE {PREFIX}_validations counter")
+            lines.append(f"# HELP {PREFIX}_validations Certs validated, by VALIDATE_ERROR code.")
+            for code, count in sorted(self.validations.items()):
+                reason = main.VALIDATE_ERROR.get(code, "unknown").replace('"', "'")
+                lines.append(f'{PREFIX}_validations_total{{code="{code}",reason="{reason}"}} {count}')
+
+            lines.append(f"# TYPE {PREFIX}_days_to_expiry gauge")
+            lines.append(f"# HELP {PREFIX}_days_to_expiry Days until the leaf cert's notAfter.")
+            for target, days in self.days.items():
+                lines.append(f'{PREFIX}_days_to_expiry{{target="{escape(target)}"}} {round(days, 3)}')
+
+            lines.append(f"# TYPE {PREFIX}_scan_success gauge")
+            lines.append(f"# HELP {PREFIX}_scan_success Whether the last scan of the target succeeded.")
+            for target, success in self.success.items():
+                lines.append(f'{PREFIX}_scan_success{{target="{escape(target)}"}} {success}')
+
+        # the caches keep their own counters
+        caches = {'cert_details': main.cert_details_cache, 'dns': main.dns_cache, 'session': main.session_cache, 'result': main.result_cache}
+        info = {name: cache.info() for name, cache in caches.items()}
+        for key in ('hits', 'misses'):
+            lines.append(f"# TYPE {PREFIX}_cache_{key} counter")
+            lines.append(f"# HELP {PREFIX}_cache_{key} Cache {key}.")
+            for name, stats in info.items():
+                lines.append(f'{PREFIX}_cache_{key}_total{{cache="{name}"}} {stats[key]}')
+        lines.append(f"# TYPE {PREFIX}_cache_hit_ratio gauge")
+        lines.append(f"# HELP {PREFIX}_cache_hit_ratio Cache hits as a fraction of lookups.")
+        for name, stats in info.items():
+            lookups = stats['hits'] + stats['misses']
+            lines.append(f'{PREFIX}_cache_hit_ratio{{cache="{name}"}} {round(stats["hits"] / lookups, 4) if lookups else 0}')
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+def escape(value: str):
+    """A label value, escaped for the text format"""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+metrics = Metrics()
+
+def scan(target: str):
+    try:
+        results = main.process(*main.parse_target(target), fields=monitor.FIELDS)
+    except Exception:
+        metrics.record_error(target)
+        return
+    metrics.record_results(target, results)
+
+def scan_loop(targets, interval: float = INTERVAL, workers: int = WORKERS, stop: threading.Event = None):
+    """Scan every target, every interval seconds, until stop is set"""
+    stop = stop or threading.Event()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        while not stop.is_set():
+            start = time.monotonic()
+            list(executor.map(scan, targets))
+            stop.wait(max(0, interval - (time.monotonic() - start)))
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics.render().encode('UTF-8')
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # scraped every few seconds; too noisy to log
+
+def cli():
+    parser = argparse.ArgumentParser(description='Serve scan results as OpenMetrics metrics')
+    parser.add_argument('targets', help='File listing the targets, one per line ("-" for stdin)')
+    parser.add_argument('-p','--port', help=f'Port to serve /metrics on (default {PORT})', type=int, default=PORT)
+    parser.add_argument('--host', help='Address to listen on (default all)', default="")
+    parser.add_argument('-i','--interval', help=f'Seconds between scans of each target (default {INTERVAL})', type=float, default=INTERVAL)
+    parser.add_argument('-w','--workers', help=f'Concurrent scans (default {WORKERS})', type=int, default=WORKERS)
+    args = parser.parse_args()
+
+    if args.targets == '-':
+        targets = list(main.read_targets(sys.stdin))
+    else:
+        with open(args.targets, "r", encoding="utf8") as f:
+            targets = list(main.read_targets(f))
+
+    threading.Thread(target=scan_loop, args=(targets, args.interval, args.workers), daemon=True).start()
+    server = ThreadingHTTPServer((args.host, args.port), MetricsHandler)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Keep a history of scan results in SQLite, and report how an endpoint's chain changed over time.
+
+Certs are stored once, by fingerprint, however many endpoints present them; each scan of an
+endpoint adds a snapshot referring to its chain by fingerprint, along with the protocol, cipher
+and validation results.
+
+Syntax:
+    ./main.py -b inventory.txt | ./history.py [-d <db>] record -
+    ./history.py [-d <db>] record results.ndjson
+    ./history.py [-d <db>] timeline hostname[:port] [servername]
+    ./history.py [-d <db>] diff [-a] hostname[:port] [servername]
+
+record reads the NDJSON output of main.py -b (or -j output, one result per line), in batches of
+one transaction each.  diff shows what changed between the last two snapshots, or with -a between
+every pair of consecutive snapshots.
+"""
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+
+import main
+
+THISFILE=os.path.abspath(__file__)
+CWD=os.path.dirname(THISFILE)
+
+HISTORY_DB=f"{CWD}/history.db"
+# snapshots written per transaction by record_many()
+BATCH_SIZE=1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS certs (
+    fingerprint TEXT PRIMARY KEY,
+    details TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS endpoints (
+    id INTEGER PRIMARY KEY,
+    hostname TEXT NOT NULL,
+    port INTEGER NOT NULL,
+    servername TEXT,
+    UNIQUE (hostname, port, servername)
+);
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY,
+    endpoint_id INTEGER NOT NULL REFERENCES endpoints (id),
+    scanned_at REAL NOT NULL,
+    protocol TEXT,
+    cipher TEXT,
+    bits INTEGER,
+    chain TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS snapshots_by_endpoint ON snapshots (endpoint_id, scanned_at);
+"""
+
+# per-connection values, kept in the snapshot rather than with the cert
+CONNECTION_FIELDS = ('validation', 'fromServer', 'trusted')
+
+class HistoryStore:
+    """Scan history in a SQLite database"""
+    def __init__(self, path: str = HISTORY_DB):
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        self.endpoint_ids = {}
+
+    def close(self):
+        self.db.close()
+
+    def endpoint_id(self, hostname: str, port: int, servername: str, create: bool = True):
+        """The id of an endpoint, adding it if it is new and create is set"""
+        key = (hostname, port, servername)
+        if key not in self.endpoint_ids:
+            row = self.db.execute("SELECT id FROM endpoints WHERE hostname = ? AND port = ? AND servername IS ?", key).fetchone()
+            if row:
+                self.endpoint_ids[key] = row[0]
+            elif create:
+                self.endpoint_ids[key] = self.db.execute("INSERT INTO endpoints (hostname, port, servername) VALUES (?, ?, ?)", key).lastrowid
+            else:
+                return None
+        return self.endpoint_ids[key]
+
+    def record_many(self, records, batch_size: int = BATCH_SIZE):
+        """Store scan records, as written by main.bulk_process(): dicts with the input
+        'target', 'scanned_at' and either 'results' or 'error'.  A record may also be
+        just the results.  Records without 'scanned_at' are stored as scanned now, and
+        errors for targets that cannot be parsed are skipped.  Certs already in the
+        store are not written again.  Returns the number stored.
+        """
+        count = 0
+        certs = {}
+        snapshots = []
+        for record in records:
+            if 'target' not in record:
+                record = {'results': record}
+            # when the scan ran, if the record says; otherwise when it is recorded
+            scanned_at = record.get('scanned_at') or time.time()
+            if 'results' in record:
+                results = record['results']
+                connection = results['connection']
+                chain = []
+                for cert in ordered_certs(results):
+                    certs[cert['SHA-1 fingerprint']] = json.dumps({k: v for k, v in cert.items() if k not in CONNECTION_FIELDS})
+                    chain.append([cert['SHA-1 fingerprint']] + [cert.get(k) for k in CONNECTION_FIELDS])
+                snapshots.append((self.endpoint_id(connection['hostname'], connection['port'], connection['servername']),
+                    scanned_at, connection['protocol'], connection['cipher'], connection['bits'], json.dumps(chain), None))
+            else:
+                try:
+                    hostname, port, servername = main.parse_target(record['target'])
+                except (ValueError, IndexError):
+                    # eg. a typo in the inventory; there is no endpoint to file it under
+                    print(f"skipping {record['target']!r}: {record['error']}", file=sys.stderr)
+                    continue
+                snapshots.append((self.endpoint_id(hostname, port, servername), scanned_at, None, None, None, None, record['error']))
+
+            count += 1
+            if len(snapshots) >= batch_size:
+                self.write(certs, snapshots)
+        self.write(certs, snapshots)
+        return count
+
+    def record(self, results: dict):
+        """Store the results of a single process() call"""
+        self.record_many([results])
+
+    def write(self, certs: dict, snapshots: list):
+        """Write, in one transaction, and clear out the pending certs and snapshots"""
+        with self.db:
+            self.db.executemany("INSERT OR IGNORE INTO certs (fingerprint, details) VALUES (?, ?)", certs.items())
+            self.db.executemany("INSERT INTO snapshots (endpoint_id, scanned_at, protocol, cipher, bits, chain, error) VALUES (?, ?, ?, ?, ?, ?, ?)", snapshots)
+        certs.clear()
+        snapshots.clear()
+
+    def timeline(self, hostname: str, port: int = 443, servername: str = None):
+        """The snapshots of an endpoint, oldest first"""
+        endpoint_id = self.endpoint_id(hostname, port, servername, create=False)
+        if endpoint_id is None:
+            return []
+        rows = self.db.execute("SELECT scanned_at, protocol, cipher, bits, chain, error FROM snapshots WHERE endpoint_id = ? ORDER BY scanned_at, id", (endpoint_id,))
+        snapshots = []
+        for scanned_at, protocol, cipher, bits, chain, error in rows:
+            snapshot = {'scanned_at': scanned_at, 'protocol': protocol, 'cipher': cipher, 'bits': bits, 'error': error, 'chain': []}
+            for fingerprint, *values in json.loads(chain or "[]"):
+                snapshot['chain'].append({'fingerprint': fingerprint, **dict(zip(CONNECTION_FIELDS, values))})
+            snapshots.append(snapshot)
+        return snapshots
+
+    def cert(self, fingerprint: str):
+        """The stored details of a cert"""
+        row = self.db.execute("SELECT details FROM certs WHERE fingerprint = ?", (fingerprint,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+def ordered_certs(results: dict):
+    """The certs of a result in chain order; the keys are ints from process(), strings once through json"""
+    return [cert for depth, cert in sorted(results['certs'].items(), key=lambda item: int(item[0]))]
+
+def chain_roles(snapshot: dict):
+    """Split a snapshot's chain into leaf, intermediates and root fingerprints
+    The root is the last cert if it is in the trust store; anything between it and the leaf is an intermediate.
+    """
+    chain = snapshot['chain']
+    if not chain:
+        return None, [], None
+    root = None
+    rest = chain[1:]
+    if rest and rest[-1].get('trusted'):
+        root = rest[-1]['fingerprint']
+        rest = rest[:-1]
+    return chain[0]['fingerprint'], [cert['fingerprint'] for cert in rest], root
+
+def diff(old: dict, new: dict):
+    """What changed from one snapshot to the next, as a list of dicts with 'change', 'from' and 'to'"""
+    changes = []
+    def changed(name, before, after):
+        if before != after:
+            changes.append({'change': name, 'from': before, 'to': after})
+
+    changed('error', old['error'], new['error'])
+    if old['error'] or new['error']:
+        return changes
+
+    old_leaf, old_intermediates, old_root = chain_roles(old)
+    new_leaf, new_intermediates, new_root = chain_roles(new)
+    changed('leaf', old_leaf, new_leaf)
+    changed('intermediates', old_intermediates, new_intermediates)
+    changed('root', old_root, new_root)
+    changed('protocol', old['protocol'], new['protocol'])
+    changed('cipher', old['cipher'], new['cipher'])
+    changed('validation', [cert['validation'] for cert in old['chain']], [cert['validation'] for cert in new['chain']])
+    return changes
+
+def format_time(timestamp: float):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(timestamp))
+
+def print_diff(store: HistoryStore, old: dict, new: dict):
+    print(f"{format_time(old['scanned_at'])} -> {format_time(new['scanned_at'])}")
+    changes = diff(old, new)
+    if not changes:
+        print("  no changes")
+    for change in changes:
+        if change['change'] in ('leaf', 'root') and change['to']:
+            subject = (store.cert(change['to']) or {}).get('subject')
+            print(f"  new {change['change']}: {change['from']} -> {change['to']} {subject}")
+        else:
+            print(f"  {change['change']}: {change['from']} -> {change['to']}")
+
+def cli():
+    parser = argparse.ArgumentParser(description='cert-inspection scan history')
+    parser.add_argument('-d','--db', help=f'History database (default {HISTORY_DB})', default=HISTORY_DB)
+    commands = parser.add_subparsers(dest='command', required=True)
+    record = commands.add_parser('record', help='Store NDJSON scan results from a file ("-" for stdin)')
+    record.add_argument('file')
+    for name in ('timeline', 'diff'):
+        command = commands.add_parser(name, help=f'Show the {name} of an endpoint')
+        command.add_argument('target', help='hostname[:port] or url')
+        command.add_argument('servername', nargs='?', default=None)
+        if name == 'diff':
+            command.add_argument('-a','--all', help='Diff every consecutive pair of snapshots', action='store_true', default=False)
+    args = parser.parse_args()
+
+    store = HistoryStore(args.db)
+    try:
+        if args.command == 'record':
+            f = sys.stdin if args.file == '-' else open(args.file, "r", encoding="utf8")
+            with f:
+                count = store.record_many(json.loads(line) for line in f if line.strip())
+            print(f"recorded {count} scans", file=sys.stderr)
+            return
+
+        hostname, port = main.get_host_port_from_input(args.target)
+        snapshots = store.timeline(hostname, port, args.servername or hostname)
+        if not snapshots:
+            raise SystemExit(f"No history for {args.target}")
+
+        if args.command == 'timeline':
+            for snapshot in snapshots:
+                if snapshot['error']:
+                    print(f"{format_time(snapshot['scanned_at'])} error: {snapshot['error']}")
+                else:
+                    leaf, intermediates, root = chain_roles(snapshot)
+                    print(f"{format_time(snapshot['scanned_at'])} {snapshot['protocol']} {snapshot['cipher']} leaf {leaf}")
+        else:
+            pairs = list(zip(snapshots, snapshots[1:]))
+            if not pairs:
+                raise SystemExit(f"Only one snapshot for {args.target}")
+            if not args.all:
+                pairs = pairs[-1:]
+            for old, new in pairs:
+                print_diff(store, old, new)
+    finally:
+        store.close()
+
+if __name__ == '__main__':
+    cli()
@@ -1,14 +1,24 @@
 #!/usr/bin/env python3
 
+import time
+INIT_START=time.perf_counter()  # for the cold start metric, see lambda_handler()
+
 import os
 import sys
 import datetime
-import argparse
-import certifi
 import socket
 import json
+import contextlib
+import threading
+import collections
+import hashlib
+import select
+import gzip
+import base64
 from OpenSSL import crypto  # https://www.pyopenssl.org/en/stable/api/crypto.html
 from OpenSSL import SSL     # https://www.pyopenssl.org/en/stable/api/ssl.html
+# argparse, asyncio, concurrent.futures and certifi are only imported where they are needed, to keep
+# the lambda cold start short
 
 # from https://www.openssl.org/docs/man1.0.2/man1/verify.html since there does not seem to be a way to query for the code
 VALIDATE_ERROR = {
@@ -47,12 +57,91 @@ VALIDATE_ERROR = {
 }
 
 FILE=os.path.abspath(__file__)
+TRUST_INDEX=f"{os.path.dirname(FILE)}/trust_index.bin"
+TRUST_INDEX_MAGIC=b"CERTIDX1"
+# one file per cert, as written by older versions of populateSKI.py; only used if there is no TRUST_INDEX
 TRUSTED_CERT_DIR=f"{os.path.dirname(FILE)}/subjectKeyIdentifier"
-if not os.path.exists(TRUSTED_CERT_DIR):
-    raise SystemExit(f"Cannot find trusted cert dir {TRUSTED_CERT_DIR} - you need to run populateSKI.py first.")
+# the CA bundle built by populateSKI.py, used to verify against if present, else certifi's
+TRUST_BUNDLE=f"{os.path.dirname(FILE)}/trust_bundle.pem"
+default_cafile_name=None
+
+# lambda metrics, see lambda_handler()
+METRICS_NAMESPACE=os.environ.get("METRICS_NAMESPACE", "cert-inspection")
+init_duration=None
+first_request=True
+
+# in-memory index of the trusted certs, loaded once by get_trust_store()
+trust_store=None
+trust_store_lock=threading.Lock()
+
+# SSL.Contexts created by get_context(), so the CA file is only parsed once per process
+context_cache={}
+context_cache_lock=threading.Lock()
+VERIFY_DEPTH=10
+
+# parsed cert details, by digest of the cert, see get_cert_details()
+CERT_DETAILS_CACHE_SIZE=1024
+
+# the cert details that are not extensions, see parse_cert_details()
+CERT_BASIC_FIELDS=frozenset(['subject', 'serialized_subject', 'issuer', 'notBefore', 'notAfter', 'expired',
+    'SHA-1 fingerprint', 'serialnumber', 'version', 'signature_algorithm', 'cert'])
+# the cert details add_chain_details() needs for the trust store lookups
+CHAIN_FIELDS=frozenset(['serialized_subject', 'subjectKeyIdentifier', 'authorityKeyIdentifier'])
+# per-cert results that are always included, whatever fields are selected
+RESULT_FIELDS=frozenset(['validation', 'fromServer', 'trusted'])
+# named sets of fields; None is everything
+FIELD_PROFILES={
+    'full': None,
+    'summary': ['subject', 'issuer', 'notBefore', 'notAfter', 'expired'],
+}
+
+# deadlines, in seconds, for each phase of a scan and for the scan as a whole
+CONNECT_TIMEOUT=5
+HANDSHAKE_TIMEOUT=10
+SCAN_TIMEOUT=20
+
+# resolved addresses, by (hostname, port), see resolve()
+DNS_CACHE_TTL=int(os.environ.get("DNS_CACHE_TTL", 60))
+DNS_CACHE_SIZE=4096
+
+# protocol and cipher enumeration, see enumerate_tls()
+ENUM_VERSIONS={          # newest first
+    'TLSv1.3': SSL.TLS1_3_VERSION,
+    'TLSv1.2': SSL.TLS1_2_VERSION,
+    'TLSv1.1': SSL.TLS1_1_VERSION,
+    'TLSv1': SSL.TLS1_VERSION,
+}
+ENUM_CIPHERS="ALL:COMPLEMENTOFALL:@SECLEVEL=0"  # every cipher this OpenSSL knows, however weak
+ENUM_TLS13_CIPHERS=['TLS_AES_256_GCM_SHA384', 'TLS_CHACHA20_POLY1305_SHA256', 'TLS_AES_128_GCM_SHA256', 'TLS_AES_128_CCM_SHA256', 'TLS_AES_128_CCM_8_SHA256']
+ENUM_BUDGET=8            # connections open at once to the host, per enumeration
+ENUM_TIMEOUT=60
+
+# TLS sessions kept for resumption, see process(resume=True)
+SESSION_CACHE_TTL=int(os.environ.get("SESSION_CACHE_TTL", 300))
+SESSION_CACHE_SIZE=1024
+# seconds to wait for a TLS 1.3 session ticket, which the server sends after the handshake
+SESSION_TICKET_WAIT=0.25
+
+# lambda_handler result cache, by (hostname, port, servername), see cached_process()
+RESULT_CACHE_TTL=int(os.environ.get("RESULT_CACHE_TTL", 300))      # seconds a result is fresh
+RESULT_CACHE_STALE=int(os.environ.get("RESULT_CACHE_STALE", 3600)) # seconds past that it may be served while refreshing
+RESULT_CACHE_SIZE=int(os.environ.get("RESULT_CACHE_SIZE", 256))    # entries kept in memory (and on disk)
+RESULT_CACHE_DIR=os.environ.get("RESULT_CACHE_DIR")                # eg. /tmp/cert-inspection; no disk tier if unset
+
+# lambda_handler compresses responses of at least this many bytes, if the client accepts gzip
+GZIP_MIN_SIZE=1024
+GZIP_LEVEL=6
+
+# POSTed batches of targets to lambda_handler, see batch_process()
+BATCH_MAX_TARGETS=100
+BATCH_WORKERS=16
+BATCH_MARGIN=1     # seconds kept back to return the response before lambda's own timeout
 
-# hold the cert validation results, indexed by depth
-verified={}
+# default number of worker threads for bulk scans
+BULK_WORKERS=32
+# default limits for the asyncio scan engine
+ASYNC_CONCURRENCY=1000
+ASYNC_PER_HOST=4
 
 def get_date_from_asn1(asn1_timestamp):
     # https://docs.python.org/3/library/datetime.html
@@ -78,92 +167,450 @@ def serialized_dn(tuple_list):
 
 def verify(conn, x509, errnum, depth, returncode):
     """The callback function for OpenSSL.SSL.Context.verify()
-    Always exit with True so that the caller can continue with the connection.
+    Always exit with True so that the caller can continue with the connection,
+    and never raise: the context is shared, and pyOpenSSL keeps a callback's
+    exception on it, where it could surface on another connection.
     This is a callback function so that we can keep track of the verification
-    results.
+    results.  The results are kept per connection in a dict indexed by depth,
+    in the state dict attached to the connection via set_app_data(), so that
+    process() can run in multiple threads at once.
     """
-    global verified
+    verified = conn.get_app_data()['verified']
     if depth not in verified:
         # verified[depth]=f"verify:depth:{depth} {x509_dn(x509.get_subject().get_components())} - {errnum}: {VALIDATE_ERROR[errnum]}"
-        verified[depth]=f"verify:depth:{depth} - {errnum}: {VALIDATE_ERROR[errnum]}"
+        verified[depth]=f"verify:depth:{depth} - {errnum}: {VALIDATE_ERROR.get(errnum, f'unknown error {errnum}')}"
     elif errnum:
-        verified[depth]=f"{verified[depth]} - {errnum}: {VALIDATE_ERROR[errnum]}"
+        verified[depth]=f"{verified[depth]} - {errnum}: {VALIDATE_ERROR.get(errnum, f'unknown error {errnum}')}"
     return True
 
-def get_cert_details(cert):
+def ocsp_staple(conn, ocsp_data, data):
+    """The callback function for OpenSSL.SSL.Context.set_ocsp_client_callback()
+    Keeps the OCSP response the server stapled (if any) in the connection's
+    state, for the revocation check; the handshake always goes ahead.
+    """
+    conn.get_app_data()['ocsp'] = ocsp_data
+    return True
+
+class LRUCache:
+    """A thread-safe, size-bounded least-recently-used cache with hit/miss counters
+    If ttl is given, entries expire that many seconds after they were put.
+    """
+    def __init__(self, maxsize: int, ttl: float = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = collections.OrderedDict()  # key -> (expiry time or None, value)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                expires, value = self.data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires is not None and expires < time.monotonic():
+                del self.data[key]
+                self.misses += 1
+                return default
+            self.data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        expires = None
+        if self.ttl is not None:
+            expires = time.monotonic() + self.ttl
+        with self.lock:
+            self.data[key] = (expires, value)
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        """Counters, suitable for including in json output"""
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.data), 'maxsize': self.maxsize}
+
+cert_details_cache = LRUCache(CERT_DETAILS_CACHE_SIZE)
+
+def get_cert_details(cert, fields: frozenset = None):
+    """The details of a cert, as included in the results
+    fields limits the details to just those named, see parse_cert_details().
+    The same intermediates turn up in most chains, so the parsed details are
+    kept in cert_details_cache, keyed by the digest of the DER encoded cert.
+    A copy is returned, so the caller is free to modify it.
+    """
+    key = (cert.digest("sha256"), fields)
+    details = cert_details_cache.get(key)
+    if details is None:
+        details = parse_cert_details(cert, fields)
+        cert_details_cache.put(key, details)
+    this_cert = dict(details)
+    if 'expired' in this_cert:
+        this_cert['expired'] = cert.has_expired()  # may have changed since it was cached
+    return this_cert
+
+def parse_cert_details(cert, fields: frozenset = None):
+    """Parse the details of a cert
+    If fields is given, only the details named in it are worked out, so eg. the
+    PEM dump and the extension strings are skipped unless asked for.
+    Extensions are named by their short name, eg. subjectAltName.
+    """
     this_cert = {}
 
     # cert is an crypto.X509 object (https://www.pyopenssl.org/en/stable/api/crypto.html)
-    this_cert['subject'] = x509_dn(cert.get_subject().get_components())
-    this_cert['serialized_subject'] = serialized_dn(cert.get_subject().get_components())
-    this_cert['issuer'] = x509_dn(cert.get_issuer().get_components())
-    this_cert['notBefore'] = get_date_from_asn1(cert.get_notBefore().decode('UTF-8'))  # ASN.1 TIME: YYYYMMDDhhmmssZ
-    this_cert['notAfter'] = get_date_from_asn1(cert.get_notAfter().decode('UTF-8'))    # ASN.1 TIME: YYYYMMDDhhmmssZ
-    this_cert['expired'] = cert.has_expired()
-    this_cert['SHA-1 fingerprint'] = cert.digest("sha1").decode("UTF-8")
-    this_cert['serialnumber'] = str(cert.get_serial_number())
-    this_cert['version'] = cert.get_version()
-    this_cert['signature_algorithm'] = cert.get_signature_algorithm().decode("UTF-8")
-    for i in range(0,cert.get_extension_count()):
-        try:
-            ext=cert.get_extension(i)
-            this_cert[ext.get_short_name().decode('UTF-8')] = str(ext)
-        except:
-            pass
+    if not fields or 'subject' in fields:
+        this_cert['subject'] = x509_dn(cert.get_subject().get_components())
+    if not fields or 'serialized_subject' in fields:
+        this_cert['serialized_subject'] = serialized_dn(cert.get_subject().get_components())
+    if not fields or 'issuer' in fields:
+        this_cert['issuer'] = x509_dn(cert.get_issuer().get_components())
+    if not fields or 'notBefore' in fields:
+        this_cert['notBefore'] = get_date_from_asn1(cert.get_notBefore().decode('UTF-8'))  # ASN.1 TIME: YYYYMMDDhhmmssZ
+    if not fields or 'notAfter' in fields:
+        this_cert['notAfter'] = get_date_from_asn1(cert.get_notAfter().decode('UTF-8'))    # ASN.1 TIME: YYYYMMDDhhmmssZ
+    if not fields or 'expired' in fields:
+        this_cert['expired'] = cert.has_expired()
+    if not fields or 'SHA-1 fingerprint' in fields:
+        this_cert['SHA-1 fingerprint'] = cert.digest("sha1").decode("UTF-8")
+    if not fields or 'serialnumber' in fields:
+        this_cert['serialnumber'] = str(cert.get_serial_number())
+    if not fields or 'version' in fields:
+        this_cert['version'] = cert.get_version()
+    if not fields or 'signature_algorithm' in fields:
+        this_cert['signature_algorithm'] = cert.get_signature_algorithm().decode("UTF-8")
+    if not fields or not fields <= CERT_BASIC_FIELDS:
+        for i in range(0,cert.get_extension_count()):
+            try:
+                ext=cert.get_extension(i)
+                name = ext.get_short_name().decode('UTF-8')
+                if not fields or name in fields:
+                    this_cert[name] = str(ext)
+            except:
+                pass
     ## the PEM cert itself
-    this_cert['cert'] = crypto.dump_certificate(type=crypto.FILETYPE_PEM, cert=cert).decode('UTF-8')
+    if not fields or 'cert' in fields:
+        this_cert['cert'] = crypto.dump_certificate(type=crypto.FILETYPE_PEM, cert=cert).decode('UTF-8')
 
     return this_cert
 
-def process(hostname: str, port: int = 443, servername: str = None):
-    """Process a target"""
-    results = {'certs': {}}
-    global verified
-    verified = {}
-    cafile=certifi.where()
-    results['cafile'] = cafile
+def get_fields(fields: str = None, profile: str = None):
+    """The set of cert details to include in results, from a comma separated
+    list of field names and/or the name of one of the FIELD_PROFILES
+    None means all of them.
+    """
+    if profile:
+        if profile not in FIELD_PROFILES:
+            raise ValueError(f"Unknown profile {profile}, expecting one of {', '.join(FIELD_PROFILES)}")
+        if FIELD_PROFILES[profile] is None:
+            return None
+        selected = set(FIELD_PROFILES[profile])
+    else:
+        selected = set()
+    if fields:
+        selected.update(field.strip() for field in fields.split(","))
+    return frozenset(selected) or None
+
+def trusted_root_details(cert):
+    """The details of a cert from the trust store, ready to be added to the results as a trusted root"""
+    this_cert = get_cert_details(cert)
+    if "authorityKeyIdentifier" in this_cert:
+        if "keyid:" in this_cert['authorityKeyIdentifier']:  # handle old syntax
+            this_cert['authorityKeyIdentifier'] = this_cert['authorityKeyIdentifier'][6:].split("\n")[0]
+    this_cert["trusted"] = True
+    this_cert['fromServer'] = False
+    if 'validation' not in this_cert:
+        this_cert['validation'] = ""
+    return this_cert
+
+def load_trust_index(index_file: str = TRUST_INDEX):
+    """Load the trust index file written by populateSKI.py, in one read
+    Returns a dict of SKI -> cert details, and serialized DN -> cert details for
+    certs without a SKI, as the per-file layout of load_trust_store() has it.
+    """
+    with open(index_file, "rb") as f:
+        contents = memoryview(f.read())
+    if contents[:len(TRUST_INDEX_MAGIC)] != TRUST_INDEX_MAGIC:
+        raise SystemExit(f"{index_file} is not a trust index - rerun populateSKI.py")
+    header_start = len(TRUST_INDEX_MAGIC) + 4
+    header_len = int.from_bytes(contents[len(TRUST_INDEX_MAGIC):header_start], "big")
+    header = json.loads(bytes(contents[header_start:header_start + header_len]))
+    blobs = header_start + header_len
+
+    store = {}
+    for ski, dn, offset, length in header['entries']:
+        der = bytes(contents[blobs + offset:blobs + offset + length])
+        this_cert = trusted_root_details(crypto.load_certificate(type = crypto.FILETYPE_ASN1, buffer = der))
+        # only certs without a SKI are found by DN, so a root with the same DN but a
+        # different key than the chain's authorityKeyIdentifier is never matched
+        if ski:
+            store[ski] = this_cert
+        else:
+            store.setdefault(dn, this_cert)
+    return store
 
-    # Create a context
+def load_trust_store(cert_dir: str = TRUSTED_CERT_DIR):
+    """Load every cert in the trusted cert dir (as written by older versions of populateSKI.py)
+    Returns a dict of file name (the SKI, or the serialized DN for certs without
+    one) -> the cert details, ready to be added to the results as a trusted root.
+    """
+    store = {}
+    for name in os.listdir(cert_dir):
+        with open(f"{cert_dir}/{name}", "r", encoding="utf8") as f:
+            trusted_cert_pem = f.read()
+        cert = crypto.load_certificate(type = crypto.FILETYPE_PEM, buffer = trusted_cert_pem)
+        store[name] = trusted_root_details(cert)
+    return store
+
+def get_trust_store():
+    """The trust store index, loaded on first use and kept for the life of the process"""
+    global trust_store
+    if trust_store is None:
+        with trust_store_lock:
+            if trust_store is None:
+                if os.path.exists(TRUST_INDEX):
+                    trust_store = load_trust_index()
+                elif os.path.exists(TRUSTED_CERT_DIR):
+                    trust_store = load_trust_store()
+                else:
+                    raise SystemExit(f"Cannot find trust index {TRUST_INDEX} - you need to run populateSKI.py first.")
+    return trust_store
+
+def default_cafile():
+    """The CA bundle to verify against by default
+    That is the bundle populateSKI.py built alongside the trust index, which
+    includes any private CAs, or certifi's if there isn't one.
+    """
+    global default_cafile_name
+    if default_cafile_name is None:
+        if os.path.exists(TRUST_BUNDLE):
+            default_cafile_name = TRUST_BUNDLE
+        else:
+            import certifi
+            default_cafile_name = certifi.where()
+    return default_cafile_name
+
+def warm_up():
+    """Load the trust store and create the default context ahead of the first scan"""
+    get_trust_store()
+    get_context(default_cafile())
+
+def new_context(cafile: str, verify_depth: int = VERIFY_DEPTH):
+    """Create an SSL.Context that verifies against cafile, recording results via verify()"""
     # https://www.pyopenssl.org/en/stable/api/ssl.html
     context = SSL.Context(method=SSL.TLS_METHOD)
     context.load_verify_locations(cafile=cafile)
     context.set_verify(SSL.VERIFY_PEER, callback=verify) # Default VERIFY_NONE
-    context.set_verify_depth(10)
+    context.set_verify_depth(verify_depth)
     context.set_timeout(10)
+    # only called for connections that request_ocsp()
+    context.set_ocsp_client_callback(ocsp_staple)
+    return context
 
-    # Establish the connection
-    conn = SSL.Connection(
-        context, socket=socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    )
-    try:
-        conn.connect((hostname, port))
-    except socket.gaierror:
-        raise ValueError(f"Cannot resolve hostname {hostname}")
-    conn.setblocking(1)
-    if servername:
-        conn.set_tlsext_host_name(servername.encode()) # SNI; needs to be before handshake step
-    conn.do_handshake()
-    results['connection'] = {
+def get_context(cafile: str, verify_depth: int = VERIFY_DEPTH):
+    """Get a shared SSL.Context for cafile, creating it on first use
+    Loading the CA file is the expensive part of setting up a connection, so the
+    context is reused by every scan in the process.  The context itself holds no
+    per-connection state; verify() keeps its results on the connection.  The
+    cache key includes the CA file's modification time and size, so an updated
+    CA file gets a fresh context.  clear_context_cache() drops them all.
+    """
+    stat = os.stat(cafile)
+    key = (cafile, verify_depth, stat.st_mtime_ns, stat.st_size)
+    context = context_cache.get(key)
+    if context is None:
+        with context_cache_lock:
+            context = context_cache.get(key)
+            if context is None:
+                # forget contexts for older versions of this CA file
+                for old_key in [k for k in context_cache if k[:2] == key[:2]]:
+                    del context_cache[old_key]
+                context = new_context(cafile, verify_depth)
+                context_cache[key] = context
+    return context
+
+def clear_context_cache():
+    """Forget all the cached SSL.Contexts, eg. after changing a CA file in place"""
+    with context_cache_lock:
+        context_cache.clear()
+
+# (hostname, port, servername, cafile) -> (SSL.Session, verify() results of the full handshake)
+session_cache = LRUCache(SESSION_CACHE_SIZE, ttl=SESSION_CACHE_TTL)
+
+dns_cache = LRUCache(DNS_CACHE_SIZE, ttl=DNS_CACHE_TTL)
+
+def getaddrinfo_within(hostname: str, port: int, deadline: float):
+    """socket.getaddrinfo(), given up on at deadline (a time.monotonic() value)
+    getaddrinfo() cannot be interrupted, so it runs in a daemon thread, which is
+    left to finish on its own if the deadline passes first.
+    """
+    timeout = deadline - time.monotonic()
+    if timeout <= 0:
+        raise TimeoutError(f"Timed out before resolving {hostname}")
+    finished = threading.Event()
+    outcome = []  # the addrinfo, or the exception
+
+    def lookup():
+        try:
+            outcome.append(socket.getaddrinfo(hostname, port, type=socket.SOCK_STREAM))
+        except Exception as exc:
+            outcome.append(exc)
+        finished.set()
+
+    threading.Thread(target=lookup, daemon=True).start()
+    if not finished.wait(timeout):
+        raise TimeoutError(f"Timed out resolving {hostname}")
+    if isinstance(outcome[0], Exception):
+        raise outcome[0]
+    return outcome[0]
+
+def resolve(hostname: str, port: int, deadline: float = None):
+    """Resolve hostname to a list of (family, sockaddr), for all its A and AAAA addresses
+    The lookups are kept in dns_cache for DNS_CACHE_TTL seconds.  If deadline (a
+    time.monotonic() value) is given, a lookup still going then is given up on.
+    """
+    key = (hostname, port)
+    addresses = dns_cache.get(key)
+    if addresses is None:
+        try:
+            if deadline is None:
+                addrinfo = socket.getaddrinfo(hostname, port, type=socket.SOCK_STREAM)
+            else:
+                addrinfo = getaddrinfo_within(hostname, port, deadline)
+        except socket.gaierror:
+            raise ValueError(f"Cannot resolve hostname {hostname}")
+        addresses = unique_addresses(addrinfo)
+        dns_cache.put(key, addresses)
+    return addresses
+
+async def resolve_async(hostname: str, port: int):
+    """The asyncio counterpart of resolve(), sharing its cache"""
+    import asyncio
+    key = (hostname, port)
+    addresses = dns_cache.get(key)
+    if addresses is None:
+        try:
+            addrinfo = await asyncio.get_running_loop().getaddrinfo(hostname, port, type=socket.SOCK_STREAM)
+        except socket.gaierror:
+            raise ValueError(f"Cannot resolve hostname {hostname}")
+        addresses = unique_addresses(addrinfo)
+        dns_cache.put(key, addresses)
+    return addresses
+
+def unique_addresses(addrinfo):
+    """The distinct (family, sockaddr) pairs from a getaddrinfo() result, in order"""
+    addresses = []
+    for family, type, proto, canonname, sockaddr in addrinfo:
+        if (family, sockaddr) not in addresses:
+            addresses.append((family, sockaddr))
+    return addresses
+
+def time_left(deadline: float, phase_timeout: float, what: str):
+    """Seconds left for a phase of a scan, limited by both the phase's own
+    timeout and the overall deadline (a time.monotonic() value)
+    """
+    left = min(phase_timeout, deadline - time.monotonic())
+    if left <= 0:
+        raise TimeoutError(f"Timed out before {what}")
+    return left
+
+def elapsed_ms(start: float):
+    """Milliseconds since start, a time.perf_counter() value"""
+    return round((time.perf_counter() - start) * 1000, 2)
+
+def connect(addresses, deadline: float):
+    """Open a TCP connection to the first of addresses that accepts one
+    Each attempt is limited to CONNECT_TIMEOUT seconds, and all of them to the
+    deadline.  Returns the socket and the sockaddr it is connected to.
+    """
+    error = None
+    for family, sockaddr in addresses:
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(time_left(deadline, CONNECT_TIMEOUT, f"connecting to {sockaddr[0]}"))
+            sock.connect(sockaddr)
+            return sock, sockaddr
+        except socket.timeout:
+            sock.close()
+            error = TimeoutError(f"Timed out connecting to {sockaddr[0]} port {sockaddr[1]}")
+        except OSError as exc:
+            sock.close()
+            error = exc
+    raise error
+
+def do_handshake(conn, sock, deadline: float):
+    """Do the handshake on a non-blocking connection, waiting no longer than
+    HANDSHAKE_TIMEOUT seconds or the deadline
+    """
+    deadline = time.monotonic() + time_left(deadline, HANDSHAKE_TIMEOUT, "the TLS handshake")
+    while True:
+        try:
+            conn.do_handshake()
+            return
+        except SSL.WantReadError:
+            ready = select.select([sock], [], [], max(0, deadline - time.monotonic()))[0]
+        except SSL.WantWriteError:
+            ready = select.select([], [sock], [], max(0, deadline - time.monotonic()))[1]
+        if not ready:
+            raise TimeoutError("Timed out during the TLS handshake")
+
+def receive_session_ticket(conn, sock, deadline: float):
+    """Give the server up to SESSION_TICKET_WAIT seconds to send its TLS 1.3
+    session ticket, and let OpenSSL read it, so that conn.get_session() returns
+    a session that can be resumed.  The ticket only comes after the handshake.
+    """
+    wait = min(SESSION_TICKET_WAIT, deadline - time.monotonic())
+    if wait > 0 and select.select([sock], [], [], wait)[0]:
+        try:
+            conn.recv(1)
+        except SSL.Error:
+            pass # WantReadError once the ticket is read, or the server closed the connection
+
+def get_connection_details(conn, hostname: str, port: int, servername: str, address: str = None, resumed: bool = False):
+    """The connection section of the results, from a connection that has completed its handshake"""
+    return {
         'hostname': hostname,
         'port': port,
+        'address': address,
         'servername': servername,
         'cipher': conn.get_cipher_name(),
         'protocol': conn.get_cipher_version(),
-        'bits': conn.get_cipher_bits()
+        'bits': conn.get_cipher_bits(),
+        'resumed': resumed
     }
 
-    # Get cert details
+def add_chain_details(results: dict, chain, verified: dict, fields: frozenset = None):
+    """Add the details of the cert chain the server presented to results['certs']
+    verified is the per-connection dict of verify() results, indexed by depth.
+    fields limits the cert details included, see get_fields().
+    If the trusted root was not sent by the server, it is looked up in the local
+    trust store and added as the last cert in the chain.
+    If results has a timing section, the time spent parsing certs and looking
+    them up in the trust store is added to it.
+    """
+    start = time.perf_counter()
+    parse_time = 0
+    store = get_trust_store()
     trusted=False
     last_issuer_dn=[]
     last_issuer_SKID=None
     last_idx=0
 
-    for (idx, cert) in enumerate(conn.get_peer_cert_chain()):
+    for (idx, cert) in enumerate(chain):
         last_issuer_dn=[]
         last_issuer_SKID=None
         last_idx=idx
 
-        this_cert = get_cert_details(cert)
+        parse_start = time.perf_counter()
+        this_cert = get_cert_details(cert, fields and fields | CHAIN_FIELDS)
+        parse_time += time.perf_counter() - parse_start
         try:
             this_cert["validation"] = verified[idx]
         except KeyError:
@@ -174,11 +621,11 @@ def process(hostname: str, port: int = 443, servername: str = None):
         # See if it is in the CA trust store, either by SKID or DN
         # this_cert['trusted'] = False 
         if "subjectKeyIdentifier" in this_cert:
-            if os.path.exists(f"{TRUSTED_CERT_DIR}/{this_cert['subjectKeyIdentifier']}"):
+            if this_cert['subjectKeyIdentifier'] in store:
                 this_cert['trusted'] = True
                 trusted = True
         else:
-            if os.path.exists(f"{TRUSTED_CERT_DIR}/{this_cert['serialized_subject']}"):
+            if this_cert['serialized_subject'] in store:
                 this_cert['trusted'] = True
                 trusted = True
 
@@ -190,36 +637,474 @@ def process(hostname: str, port: int = 443, servername: str = None):
 
         results['certs'][idx] = this_cert
 
-    conn.shutdown()
-    conn.close()
-
     # See if need to get Trusted CA from local trust store
     if not trusted:
         # Cert not trusted, but look in trust store
-        rootcafile=None
-        if os.path.exists(f"{TRUSTED_CERT_DIR}/{last_issuer_SKID}"):
-            rootcafile = f"{TRUSTED_CERT_DIR}/{last_issuer_SKID}"
-        elif os.path.exists(f"{TRUSTED_CERT_DIR}/{serialized_dn(last_issuer_dn)}"):
-            rootcafile = f"{TRUSTED_CERT_DIR}/{serialized_dn(last_issuer_dn)}"
-
-        if rootcafile:
-            # load this as the trusted root
-            with open(rootcafile, "r", encoding="utf8") as f:
-                trusted_cert_pem = f.read()
-                f.close()
-            cert = crypto.load_certificate(type = crypto.FILETYPE_PEM, buffer = trusted_cert_pem)
-            this_cert = get_cert_details(cert)  
-            if "authorityKeyIdentifier" in this_cert:
-                if "keyid:" in this_cert['authorityKeyIdentifier']:  # handle old syntax
-                    this_cert['authorityKeyIdentifier'] = this_cert['authorityKeyIdentifier'][6:].split("\n")[0]
-            this_cert["trusted"] = True
-            this_cert['fromServer'] = False
-            if 'validation' not in this_cert:
-                this_cert['validation'] = ""
-            results['certs'][last_idx + 1] = this_cert
+        root = store.get(last_issuer_SKID)
+        if not root:
+            root = store.get(serialized_dn(last_issuer_dn))
+        if root:
+            # copy, since the caller is free to modify the results
+            results['certs'][last_idx + 1] = dict(root)
+
+    if fields:
+        for idx, this_cert in results['certs'].items():
+            results['certs'][idx] = {k: v for k, v in this_cert.items() if k in fields or k in RESULT_FIELDS}
 
+    if 'timing' in results:
+        results['timing']['parse'] = round(parse_time * 1000, 2)
+        results['timing']['trust'] = round((time.perf_counter() - start - parse_time) * 1000, 2)
+    return results
+
+def trusted_issuer(cert):
+    """The cert in the trust store that issued cert, or None"""
+    store = get_trust_store()
+    issuer_SKID = get_cert_details(cert, CHAIN_FIELDS).get('authorityKeyIdentifier', "")
+    if "keyid:" in issuer_SKID:  # handle old syntax
+        issuer_SKID = issuer_SKID[6:].split("\n")[0]
+    root = store.get(issuer_SKID) or store.get(serialized_dn(cert.get_issuer().get_components()))
+    if root:
+        return crypto.load_certificate(type = crypto.FILETYPE_PEM, buffer = root['cert'])
+    return None
+
+def add_revocation(results: dict, chain, staple: bytes, deadline: float):
+    """Add the revocation status of each cert the server presented, see revocation.py
+    staple is the OCSP response the server stapled to the handshake, if any.
+    Each cert that could be checked gets a revocation section, and revoked ones
+    also get a "certificate revoked" error added to their validation results.
+    The fetches share what is left of deadline; once it has passed, the certs
+    not yet checked are reported as unknown ("out of time"), rather than the
+    whole scan failing.
+    """
+    import revocation
+    issuers = list(chain[1:]) + [trusted_issuer(chain[-1])]
+    for idx, status in enumerate(revocation.check_chain(chain, issuers, staple, deadline)):
+        if status is None:
+            continue
+        this_cert = results['certs'][idx]
+        this_cert['revocation'] = status
+        if status['status'] == 'revoked':
+            this_cert['validation'] = f"{this_cert.get('validation', f'verify:depth:{idx}')} - 23: {VALIDATE_ERROR[23]}"
+    return results
+
+def process(hostname: str, port: int = 443, servername: str = None, cafile: str = None, address: str = None, timeout: float = SCAN_TIMEOUT, fields: frozenset = None, resume: bool = False, full_handshake: bool = False, check_revocation: bool = False):
+    """Process a target
+    cafile is the CA bundle to verify against, default_cafile() by default
+    address is the IP address to connect to; by default the first of the
+    hostname's addresses that accepts a connection is used
+    timeout is the deadline in seconds for the whole scan; the connect and the
+    handshake are also limited to CONNECT_TIMEOUT and HANDSHAKE_TIMEOUT.
+    fields limits the cert details included, see get_fields().
+    resume keeps the TLS session in session_cache, and resumes it on the next scan
+    of the same target, saving both sides a full handshake.  The server does not
+    send its chain again on a resumed handshake, so the chain and validation
+    results are those of the full handshake the session came from; use
+    full_handshake to fetch the chain afresh (and cache the new session).
+    connection.resumed in the results says whether the session was resumed.
+    check_revocation adds the revocation status of each cert, see add_revocation().
+    The timing section of the results gives the milliseconds spent in each phase.
+    """
+    start = time.perf_counter()
+    deadline = time.monotonic() + timeout
+    results = {'certs': {}}
+    # hold the cert validation results for this connection, indexed by depth
+    verified = {}
+    if not cafile:
+        cafile=default_cafile()
+    results['cafile'] = cafile
+    results['timing'] = timing = {}
+
+    # Get the (shared) context
+    context = get_context(cafile)
+    session_key = (hostname, port, servername, cafile)
+    cached_session = None
+    if resume and not full_handshake:
+        cached_session = session_cache.get(session_key)
+
+    # Establish the connection
+    phase_start = time.perf_counter()
+    addresses = resolve(address or hostname, port, deadline)
+    timing['dns'] = elapsed_ms(phase_start)
+
+    phase_start = time.perf_counter()
+    sock, sockaddr = connect(addresses, deadline)
+    timing['connect'] = elapsed_ms(phase_start)
+    state = {'verified': verified, 'ocsp': None}
+    try:
+        sock.setblocking(False)
+        conn = SSL.Connection(context, socket=sock)
+        conn.set_app_data(state)
+        conn.set_connect_state()
+        if check_revocation:
+            conn.request_ocsp()
+        if servername:
+            conn.set_tlsext_host_name(servername.encode()) # SNI; needs to be before handshake step
+        if cached_session:
+            conn.set_session(cached_session[0])
+        phase_start = time.perf_counter()
+        do_handshake(conn, sock, deadline)
+        timing['handshake'] = elapsed_ms(phase_start)
+        # verify() is not called on a resumed handshake, so its results come from the cache too
+        resumed = bool(cached_session) and not verified
+        if resumed:
+            verified.update(cached_session[1])
+        results['connection'] = get_connection_details(conn, hostname, port, servername, sockaddr[0], resumed)
+        if resume and not resumed:
+            if conn.get_cipher_version() == 'TLSv1.3':
+                receive_session_ticket(conn, sock, deadline)
+            session_cache.put(session_key, (conn.get_session(), dict(verified)))
+        chain = conn.get_peer_cert_chain()
+        try:
+            conn.shutdown()
+        except SSL.Error:
+            pass # don't wait around for the server's close_notify
+    finally:
+        sock.close()
+
+    # Get cert details
+    add_chain_details(results, chain, verified, fields)
+    if check_revocation:
+        phase_start = time.perf_counter()
+        add_revocation(results, chain, state['ocsp'], deadline)
+        timing['revocation'] = elapsed_ms(phase_start)
+    timing['total'] = elapsed_ms(start)
     return(results)
 
+def process_all_addresses(hostname: str, port: int = 443, servername: str = None, cafile: str = None, workers: int = 8, timeout: float = SCAN_TIMEOUT, fields: frozenset = None):
+    """Process every A and AAAA address of a target in parallel
+    Returns the results of each address, by address, and a summary of which
+    addresses presented which chain, so that a node serving a different (eg.
+    stale) cert stands out.  timeout is the deadline for the whole lot, the DNS
+    lookup included.
+    """
+    import concurrent.futures
+    deadline = time.monotonic() + timeout
+    addresses = [sockaddr[0] for family, sockaddr in resolve(hostname, port, deadline)]
+    results = {'addresses': {}}
+
+    def process_address(address):
+        try:
+            # the summary needs the fingerprints
+            return process(hostname, port, servername, cafile, address, deadline - time.monotonic(), fields and fields | {'SHA-1 fingerprint'})
+        except Exception as exc:
+            return {'error': str(exc)}
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(workers, len(addresses))) as executor:
+        for address, address_results in zip(addresses, executor.map(process_address, addresses)):
+            results['addresses'][address] = address_results
+
+    # Group the addresses by the chain they presented, by fingerprint
+    chains = {}
+    for address, address_results in results['addresses'].items():
+        if 'error' in address_results:
+            continue
+        fingerprints = tuple(cert['SHA-1 fingerprint'] for cert in address_results['certs'].values() if cert['fromServer'])
+        chains.setdefault(fingerprints, []).append(address)
+    errors = [address for address, address_results in results['addresses'].items() if 'error' in address_results]
+
+    results['summary'] = {
+        'addresses': len(addresses),
+        'identical': len(chains) == 1 and not errors,
+        'chains': [{'fingerprints': list(fingerprints), 'addresses': chain_addresses} for fingerprints, chain_addresses in chains.items()],
+        'errors': errors
+    }
+
+    # leave out the fingerprints again, if they weren't asked for
+    if fields and 'SHA-1 fingerprint' not in fields:
+        for address_results in results['addresses'].values():
+            for cert in address_results.get('certs', {}).values():
+                cert.pop('SHA-1 fingerprint', None)
+    return results
+
+def set_ciphersuites(context, ciphersuites):
+    """Limit the TLS 1.3 cipher suites a context offers
+    pyOpenSSL has no wrapper for SSL_CTX_set_ciphersuites, so it is called
+    through pyOpenSSL's own cffi bindings.
+    """
+    from OpenSSL._util import lib
+    if not lib.SSL_CTX_set_ciphersuites(context._context, ":".join(ciphersuites).encode()):
+        raise ValueError(f"Unsupported cipher suites {ciphersuites}")
+
+def probe_cipher(addresses, servername: str, version: int, ciphers, deadline: float):
+    """One handshake, offering only the TLS version and ciphers given
+    Returns the cipher the server chose, or None if it refused them all.  The
+    certs are not verified; only the negotiation matters.
+    """
+    context = SSL.Context(method=SSL.TLS_METHOD)
+    context.set_min_proto_version(version)
+    context.set_max_proto_version(version)
+    try:
+        if version == SSL.TLS1_3_VERSION:
+            set_ciphersuites(context, ciphers)
+        else:
+            context.set_cipher_list(f"{':'.join(ciphers)}:@SECLEVEL=0".encode())
+    except SSL.Error:
+        return None # none of the ciphers can be used with this version
+
+    sock, sockaddr = connect(addresses, deadline)
+    try:
+        sock.setblocking(False)
+        conn = SSL.Connection(context, socket=sock)
+        conn.set_connect_state()
+        if servername:
+            conn.set_tlsext_host_name(servername.encode())
+        try:
+            do_handshake(conn, sock, deadline)
+        except SSL.Error:
+            return None # handshake failure, or the server closed the connection
+        return conn.get_cipher_name()
+    finally:
+        sock.close()
+
+def eliminate_ciphers(addresses, servername: str, version: int, ciphers, deadline: float):
+    """Find which of ciphers the server accepts for a TLS version
+    Offer them all, and take out whichever the server chose, until it refuses
+    the rest; one handshake per accepted cipher, plus one.  Returns the accepted
+    ciphers, the number of handshakes, and the error that cut it short, if any.
+    """
+    accepted = []
+    remaining = list(ciphers)
+    handshakes = 0
+    while remaining:
+        handshakes += 1
+        try:
+            chosen = probe_cipher(addresses, servername, version, remaining, deadline)
+        except OSError as exc:  # including TimeoutError
+            return accepted, handshakes, str(exc)
+        if chosen not in remaining:
+            break
+        accepted.append(chosen)
+        remaining.remove(chosen)
+    return accepted, handshakes, None
+
+def enumerate_tls(hostname: str, port: int = 443, servername: str = None, address: str = None, budget: int = ENUM_BUDGET, timeout: float = ENUM_TIMEOUT):
+    """Enumerate the TLS versions and ciphers a target accepts
+    Every version is probed at once.  Then for each version accepted, its
+    candidate ciphers are split into chunks, and each chunk narrowed down in
+    parallel by eliminate_ciphers(); a chunk the server accepts none of costs a
+    single handshake.  No more than budget connections are open to the host at
+    once, and the whole enumeration is limited to timeout seconds.
+    Returns the enumeration section of the results.
+    """
+    import concurrent.futures
+    start = time.perf_counter()
+    deadline = time.monotonic() + timeout
+    addresses = resolve(address or hostname, port, deadline)
+    context = SSL.Context(method=SSL.TLS_METHOD)
+    context.set_cipher_list(ENUM_CIPHERS.encode())
+    ciphers = [cipher for cipher in SSL.Connection(context).get_cipher_list() if cipher not in ENUM_TLS13_CIPHERS]
+    candidates = {name: ENUM_TLS13_CIPHERS if version == SSL.TLS1_3_VERSION else ciphers for name, version in ENUM_VERSIONS.items()}
+
+    enumeration = {'protocols': {}, 'rejected': [], 'handshakes': 0, 'errors': []}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=budget) as executor:
+        # which versions are accepted at all; the first round of elimination for each
+        versions = {name: executor.submit(probe_cipher, addresses, servername, version, candidates[name], deadline) for name, version in ENUM_VERSIONS.items()}
+        accepted = {}
+        for name, future in versions.items():
+            enumeration['handshakes'] += 1
+            try:
+                chosen = future.result()
+            except OSError as exc:
+                enumeration['errors'].append(f"{name}: {exc}")
+                continue
+            if chosen:
+                accepted[name] = chosen
+            else:
+                enumeration['rejected'].append(name)
+
+        # split what is left of the accepted versions' candidates into about budget chunks in all
+        remaining = {name: [cipher for cipher in candidates[name] if cipher != chosen] for name, chosen in accepted.items()}
+        size = max(1, -(-sum(len(ciphers) for ciphers in remaining.values()) // budget))
+        chunks = []
+        for name, ciphers in remaining.items():
+            for i in range(0, len(ciphers), size):
+                chunks.append((name, executor.submit(eliminate_ciphers, addresses, servername, ENUM_VERSIONS[name], ciphers[i:i + size], deadline)))
+
+        found = {name: {chosen} for name, chosen in accepted.items()}
+        for name, future in chunks:
+            ciphers, handshakes, error = future.result()
+            found[name].update(ciphers)
+            enumeration['handshakes'] += handshakes
+            if error:
+                enumeration['errors'].append(f"{name}: {error}")
+
+    # in the order OpenSSL lists them, strongest first
+    for name in ENUM_VERSIONS:
+        if name in found:
+            enumeration['protocols'][name] = [cipher for cipher in candidates[name] if cipher in found[name]]
+    enumeration['complete'] = not enumeration['errors']
+    enumeration['elapsed'] = elapsed_ms(start)
+    return enumeration
+
+class ScanLimits:
+    """Concurrency limits shared by process_async() calls
+    At most concurrency scans run at once overall, and at most per_host of them
+    against any one hostname.
+    """
+    def __init__(self, concurrency: int = ASYNC_CONCURRENCY, per_host: int = ASYNC_PER_HOST):
+        import asyncio
+        self.total = asyncio.Semaphore(concurrency)
+        self.per_host = per_host
+        self.hosts = {}  # hostname -> [semaphore, number of scans using it]
+
+    @contextlib.asynccontextmanager
+    async def slot(self, hostname: str):
+        """Hold a global and a per-host slot for the duration of a scan"""
+        import asyncio
+        if hostname not in self.hosts:
+            self.hosts[hostname] = [asyncio.Semaphore(self.per_host), 0]
+        host = self.hosts[hostname]
+        host[1] += 1
+        try:
+            async with host[0], self.total:
+                yield
+        finally:
+            host[1] -= 1
+            if not host[1]:
+                del self.hosts[hostname]
+
+async def wait_for_socket(sock, writable: bool):
+    """Wait until the event loop reports sock as readable (or writable)"""
+    import asyncio
+    loop = asyncio.get_running_loop()
+    ready = loop.create_future()
+    fd = sock.fileno()
+    if writable:
+        loop.add_writer(fd, lambda: ready.done() or ready.set_result(None))
+    else:
+        loop.add_reader(fd, lambda: ready.done() or ready.set_result(None))
+    try:
+        await ready
+    finally:
+        if writable:
+            loop.remove_writer(fd)
+        else:
+            loop.remove_reader(fd)
+
+async def do_handshake_async(conn, sock):
+    """Drive a non-blocking handshake from the event loop"""
+    while True:
+        try:
+            conn.do_handshake()
+            return
+        except SSL.WantReadError:
+            await wait_for_socket(sock, writable=False)
+        except SSL.WantWriteError:
+            await wait_for_socket(sock, writable=True)
+
+async def process_async(hostname: str, port: int = 443, servername: str = None, cafile: str = None, address: str = None, timeout: float = SCAN_TIMEOUT, fields: frozenset = None, limits: ScanLimits = None):
+    """Process a target from an asyncio event loop
+    The asyncio counterpart of process(), using a non-blocking socket, returning
+    the same results structure.  If limits is given, the scan waits for a slot
+    before connecting; the timeout only starts once it has one.
+    """
+    if limits:
+        async with limits.slot(hostname):
+            return await process_async(hostname, port, servername, cafile, address, timeout, fields)
+
+    import asyncio
+    start = time.perf_counter()
+    deadline = time.monotonic() + timeout
+    loop = asyncio.get_running_loop()
+    results = {'certs': {}}
+    # hold the cert validation results for this connection, indexed by depth
+    verified = {}
+    if not cafile:
+        cafile=default_cafile()
+    results['cafile'] = cafile
+    results['timing'] = timing = {}
+
+    context = get_context(cafile)
+
+    phase_start = time.perf_counter()
+    try:
+        addresses = await asyncio.wait_for(resolve_async(address or hostname, port), deadline - time.monotonic())
+    except asyncio.TimeoutError:
+        raise TimeoutError(f"Timed out resolving hostname {address or hostname}")
+    timing['dns'] = elapsed_ms(phase_start)
+
+    # Connect to the first address that accepts a connection
+    phase_start = time.perf_counter()
+    error = None
+    for family, sockaddr in addresses:
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        try:
+            await asyncio.wait_for(loop.sock_connect(sock, sockaddr), time_left(deadline, CONNECT_TIMEOUT, f"connecting to {sockaddr[0]}"))
+            break
+        except asyncio.TimeoutError:
+            sock.close()
+            error = TimeoutError(f"Timed out connecting to {sockaddr[0]} port {sockaddr[1]}")
+        except OSError as exc:
+            sock.close()
+            error = exc
+    else:
+        raise error
+    timing['connect'] = elapsed_ms(phase_start)
+
+    try:
+        conn = SSL.Connection(context, socket=sock)
+        conn.set_app_data({'verified': verified})
+        conn.set_connect_state()
+        if servername:
+            conn.set_tlsext_host_name(servername.encode()) # SNI; needs to be before handshake step
+        phase_start = time.perf_counter()
+        try:
+            await asyncio.wait_for(do_handshake_async(conn, sock), time_left(deadline, HANDSHAKE_TIMEOUT, "the TLS handshake"))
+        except asyncio.TimeoutError:
+            raise TimeoutError("Timed out during the TLS handshake")
+        timing['handshake'] = elapsed_ms(phase_start)
+        results['connection'] = get_connection_details(conn, hostname, port, servername, sockaddr[0])
+        chain = conn.get_peer_cert_chain()
+        try:
+            conn.shutdown()
+        except SSL.Error:
+            pass # don't wait around for the server's close_notify
+    finally:
+        sock.close()
+
+    # Get cert details
+    add_chain_details(results, chain, verified, fields)
+    timing['total'] = elapsed_ms(start)
+    return(results)
+
+async def scan_target_async(target: str, limits: ScanLimits, timeout: float = SCAN_TIMEOUT):
+    """Scan a single bulk input line with process_async(), returning a record suitable for NDJSON output"""
+    record = {'target': target, 'scanned_at': time.time()}
+    try:
+        record['results'] = await process_async(*parse_target(target), timeout=timeout, limits=limits)
+    except Exception as exc:
+        record['error'] = str(exc)
+    return record
+
+async def bulk_process_async(targets, out=sys.stdout, concurrency: int = ASYNC_CONCURRENCY, per_host: int = ASYNC_PER_HOST, timeout: float = SCAN_TIMEOUT):
+    """The asyncio counterpart of bulk_process()
+    Up to concurrency handshakes are in flight at once, at most per_host of them
+    to the same hostname.  Returns the number of targets scanned.
+    """
+    import asyncio
+    limits = ScanLimits(concurrency, per_host)
+    count = 0
+    max_pending = concurrency * 2
+    pending = set()
+    targets = iter(targets)
+
+    while True:
+        # top up the queue of in-flight targets
+        for target in targets:
+            pending.add(asyncio.ensure_future(scan_target_async(target, limits, timeout)))
+            if len(pending) >= max_pending:
+                break
+        if not pending:
+            break
+
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for future in done:
+            out.write(json.dumps(future.result()) + "\n")
+            count += 1
+        out.flush()
+    return count
+
 
 def get_host_port_from_input(input: str):
     """Get the hostname and port from the input
@@ -242,15 +1127,291 @@ def get_host_port_from_input(input: str):
         port = 443
     return hostname, port
 
+def parse_target(line: str):
+    """Parse a line of bulk input into (hostname, port, servername)
+    Lines are "hostname[:port] [servername]" or "url [servername]"
+    """
+    fields = line.split()
+    hostname, port = get_host_port_from_input(fields[0])
+    if len(fields) > 1:
+        servername = fields[1]
+    else:
+        servername = hostname
+    return hostname, port, servername
+
+def read_targets(stream):
+    """Yield the target lines from a file-like object, skipping blanks and # comments"""
+    for line in stream:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            yield line
+
+def scan_target(target: str, timeout: float = SCAN_TIMEOUT):
+    """Scan a single bulk input line, returning a record suitable for NDJSON output"""
+    record = {'target': target, 'scanned_at': time.time()}
+    try:
+        record['results'] = process(*parse_target(target), timeout=timeout)
+    except Exception as exc:
+        record['error'] = str(exc)
+    return record
+
+def bulk_process(targets, out=sys.stdout, workers: int = BULK_WORKERS, timeout: float = SCAN_TIMEOUT):
+    """Scan an iterable of target lines on a pool of worker threads
+    Each finished target is written to out as one line of json (NDJSON) as soon
+    as it is done, in completion order.  Only a bounded number of targets are
+    pulled from the input at a time, so memory use does not grow with the size
+    of the inventory.  Returns the number of targets scanned.
+    """
+    import concurrent.futures
+    count = 0
+    max_pending = workers * 2
+    pending = set()
+    targets = iter(targets)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            # top up the queue of in-flight targets
+            for target in targets:
+                pending.add(executor.submit(scan_target, target, timeout))
+                if len(pending) >= max_pending:
+                    break
+            if not pending:
+                break
+
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                out.write(json.dumps(future.result()) + "\n")
+                count += 1
+            out.flush()
+    return count
+
+result_cache = LRUCache(RESULT_CACHE_SIZE)
+result_refreshing = set()
+result_refreshing_lock = threading.Lock()
+
+def result_cache_file(key):
+    """The file in RESULT_CACHE_DIR holding the cached result for key"""
+    return f"{RESULT_CACHE_DIR}/{hashlib.sha256(json.dumps(key).encode()).hexdigest()}.json"
+
+def read_cached_result(key):
+    """Get a (time, results) entry from the memory cache, falling back to the disk tier"""
+    entry = result_cache.get(key)
+    if entry is None and RESULT_CACHE_DIR:
+        try:
+            with open(result_cache_file(key), "r", encoding="utf8") as f:
+                entry = tuple(json.load(f))
+        except (OSError, ValueError):
+            return None
+        result_cache.put(key, entry)
+    return entry
+
+def write_cached_result(key, results):
+    """Store results in the memory cache and the disk tier, if enabled"""
+    entry = (time.time(), results)
+    result_cache.put(key, entry)
+    if RESULT_CACHE_DIR:
+        try:
+            os.makedirs(RESULT_CACHE_DIR, exist_ok=True)
+            file = result_cache_file(key)
+            with open(f"{file}.{threading.get_ident()}", "w", encoding="utf8") as f:
+                json.dump(entry, f)
+            os.replace(f"{file}.{threading.get_ident()}", file)
+
+            # keep the disk tier to the same size bound, dropping the oldest
+            files = [f"{RESULT_CACHE_DIR}/{name}" for name in os.listdir(RESULT_CACHE_DIR) if name.endswith(".json")]
+            if len(files) > RESULT_CACHE_SIZE:
+                files.sort(key=os.path.getmtime)
+                for old_file in files[:len(files) - RESULT_CACHE_SIZE]:
+                    os.remove(old_file)
+        except OSError:
+            pass # the disk tier is only an optimization
+
+def refresh_cached_result(key):
+    """Re-scan key and update the cache, unless a refresh is already running"""
+    with result_refreshing_lock:
+        if key in result_refreshing:
+            return
+        result_refreshing.add(key)
+    try:
+        hostname, port, servername, fields = key
+        write_cached_result(key, process(hostname, port, servername, fields=fields and frozenset(fields)))
+    except Exception:
+        pass # keep serving the stale entry until it ages out
+    finally:
+        with result_refreshing_lock:
+            result_refreshing.discard(key)
+
+def cached_process(hostname: str, port: int = 443, servername: str = None, bypass: bool = False, timeout: float = SCAN_TIMEOUT, fields: frozenset = None):
+    """process() through the result cache
+    Returns the results and a dict describing the cache status: whether it was a
+    hit, the age of the entry in seconds, and whether it was stale.  Fresh
+    entries are served as is.  Stale entries (up to RESULT_CACHE_STALE seconds
+    past RESULT_CACHE_TTL) are served while a background thread re-scans the
+    target.  bypass forces a new scan, which then refreshes the cache.
+    The cached results are shared, so the caller must not modify them.
+    """
+    key = (hostname, port, servername, fields and tuple(sorted(fields)))
+    if not bypass:
+        entry = read_cached_result(key)
+        if entry:
+            age = time.time() - entry[0]
+            if age <= RESULT_CACHE_TTL:
+                return entry[1], {'hit': True, 'age': round(age), 'stale': False}
+            if age <= RESULT_CACHE_TTL + RESULT_CACHE_STALE:
+                # Note that in lambda, the refresh only runs while the container is thawed
+                threading.Thread(target=refresh_cached_result, args=(key,), daemon=True).start()
+                return entry[1], {'hit': True, 'age': round(age), 'stale': True}
+
+    results = process(hostname, port, servername, timeout=timeout, fields=fields)
+    write_cached_result(key, results)
+    return results, {'hit': False, 'age': 0, 'stale': False}
+
+def get_batch_targets(event):
+    """The targets POSTed to lambda_handler, as (target, hostname, port, servername, error)
+    The body is json, with "targets" a list of "hostname[:port] [servername]" or
+    "url [servername]" strings (as in the -b input), or of objects with "host"
+    and optionally "servername".  A target that cannot be parsed has the reason
+    as its error, and is reported as not scanned, rather than failing the batch.
+    """
+    body = event.get("body") or ""
+    if event.get("isBase64Encoded") in (True, "true"):
+        body = base64.b64decode(body).decode('UTF-8')
+    try:
+        targets = json.loads(body)["targets"]
+    except (ValueError, KeyError, TypeError):
+        raise ValueError('The body must be json with a list of "targets"')
+    if not isinstance(targets, list):
+        raise ValueError('The body must be json with a list of "targets"')
+    if len(targets) > BATCH_MAX_TARGETS:
+        raise ValueError(f"No more than {BATCH_MAX_TARGETS} targets at a time")
+
+    batch = []
+    for target in targets:
+        try:
+            if isinstance(target, dict):
+                host, servername = target.get("host"), target.get("servername")
+                if not isinstance(host, str) or not host.strip():
+                    raise ValueError('expecting a "host" string')
+                if servername is not None and not isinstance(servername, str):
+                    raise ValueError('expecting "servername" to be a string')
+                hostname, port = get_host_port_from_input(host.strip())
+                servername = servername or hostname
+            elif isinstance(target, str) and target.strip():
+                hostname, port, servername = parse_target(target)
+            else:
+                raise ValueError('expecting a "hostname[:port] [servername]" string or an object with "host"')
+            if not hostname:
+                raise ValueError("no hostname")
+            batch.append((target, hostname, port, servername, None))
+        except (ValueError, IndexError) as exc:
+            batch.append((target, None, None, None, f"Cannot parse target: {exc}"))
+    return batch
+
+def batch_process(batch, deadline: float, fields: frozenset = None, bypass: bool = False, workers: int = BATCH_WORKERS):
+    """Scan a batch of targets from get_batch_targets() concurrently, through the result cache
+    deadline (a time.monotonic() value) is when the response has to be on its
+    way; no scan runs past it, and the targets that could not be scanned by then
+    are marked "not scanned".  Returns a record per target, in the order they
+    finished, with "elapsed" the milliseconds from the start of the batch.
+    """
+    import concurrent.futures
+    start = time.perf_counter()
+
+    def scan(item):
+        target, hostname, port, servername, error = item
+        record = {'target': target}
+        if error:
+            record['error'] = error
+            record['scanned'] = False
+            return record
+        timeout = min(SCAN_TIMEOUT, deadline - time.monotonic())
+        if timeout <= 0:
+            record['error'] = "not scanned"
+            record['scanned'] = False
+            return record
+        try:
+            record['results'], record['cache'] = cached_process(hostname, port, servername, bypass=bypass, timeout=timeout, fields=fields)
+        except Exception as exc:
+            record['error'] = str(exc)
+        record['scanned'] = True
+        record['elapsed'] = elapsed_ms(start)
+        return record
+
+    records = []
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(workers, len(batch))))
+    futures = {executor.submit(scan, item): item for item in batch}
+    pending = set(futures)
+    while pending:
+        done, pending = concurrent.futures.wait(pending, timeout=max(0, deadline - time.monotonic()), return_when=concurrent.futures.FIRST_COMPLETED)
+        if not done:
+            break # out of time
+        records.extend(future.result() for future in done)
+    # don't wait for scans still running; their own timeouts end them at the deadline.
+    # (shutdown(cancel_futures=True) would do this, but needs python 3.9, and the layer is 3.8)
+    for future in pending:
+        future.cancel()
+    executor.shutdown(wait=False)
+    for future in pending:
+        records.append({'target': futures[future][0], 'error': "not scanned", 'scanned': False})
+    return records
+
+def accepts_gzip(event):
+    """Whether the request's Accept-Encoding header includes gzip"""
+    if not isinstance(event, dict) or not event.get("headers"):
+        return False
+    for name, value in event["headers"].items():
+        if name.lower() == "accept-encoding" and "gzip" in value.lower():
+            return True
+    return False
+
+def report_cold_start(first_request_ms: float):
+    """Log the cold start durations (module init, and the first request) as CloudWatch embedded metrics"""
+    print(json.dumps({
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': METRICS_NAMESPACE,
+                'Dimensions': [[]],
+                'Metrics': [
+                    {'Name': 'InitDuration', 'Unit': 'Milliseconds'},
+                    {'Name': 'FirstRequestDuration', 'Unit': 'Milliseconds'}
+                ]
+            }]
+        },
+        'InitDuration': init_duration,
+        'FirstRequestDuration': first_request_ms
+    }))
+
 def lambda_handler(event, context):
     """lambda interface"""
+    start = time.perf_counter()
     pretty=False
     host = None
     results = "nope"
     include_event = False
+    cache = None
+    batch_summary = None
 
     if event:
-        if "queryStringParameters" in event:
+        if (event.get("httpMethod") or event.get("requestContext", {}).get("http", {}).get("method")) == "POST":
+            # a batch of targets, in the body
+            parameters = event.get("queryStringParameters") or {}
+            pretty = "pretty" in parameters
+            include_event = "include_event" in parameters
+            deadline = time.monotonic() + SCAN_TIMEOUT
+            if context:
+                deadline = time.monotonic() + context.get_remaining_time_in_millis() / 1000 - BATCH_MARGIN
+            try:
+                batch = get_batch_targets(event)
+                results = batch_process(batch, deadline, get_fields(parameters.get("fields"), parameters.get("profile")), bypass="nocache" in parameters)
+                batch_summary = {
+                    'targets': len(batch),
+                    'scanned': sum(record['scanned'] for record in results),
+                    'elapsed': elapsed_ms(start)
+                }
+            except Exception as exc:
+                results = {"error": str(exc)}
+        elif "queryStringParameters" in event:
             if "host" in event["queryStringParameters"]:
                 host = event["queryStringParameters"]['host']
             
@@ -267,8 +1428,22 @@ def lambda_handler(event, context):
 
                 # print(f"processing {hostname} {port} {servername}")
             
+                # Leave time to return a response before lambda's own timeout
+                timeout = SCAN_TIMEOUT
+                if context:
+                    timeout = min(timeout, context.get_remaining_time_in_millis() / 1000 - 1)
+
                 try:
-                    results = process(hostname, port, servername)
+                    fields = get_fields(event["queryStringParameters"].get("fields"), event["queryStringParameters"].get("profile"))
+                    if "all_addresses" in event["queryStringParameters"]:
+                        results = process_all_addresses(hostname, port, servername, timeout=timeout, fields=fields)
+                    elif "revocation" in event["queryStringParameters"]:
+                        results = process(hostname, port, servername, timeout=timeout, fields=fields, check_revocation=True)
+                    else:
+                        results, cache = cached_process(hostname, port, servername, bypass="nocache" in event["queryStringParameters"], timeout=timeout, fields=fields)
+                        if "enumerate" in event["queryStringParameters"]:
+                            # a copy, so the cached result is left as it was
+                            results = dict(results, enumeration=enumerate_tls(hostname, port, servername, timeout=max(1, timeout - (time.perf_counter() - start))))
                 except Exception as exc:
                     results = {"error": str(exc)}
             else:
@@ -288,6 +1463,10 @@ def lambda_handler(event, context):
     body = {
         'results': results
     }
+    if cache:
+        body['cache'] = cache
+    if batch_summary:
+        body['batch'] = batch_summary
     if include_event:
         body['event'] = event
     if pretty:
@@ -295,12 +1474,31 @@ def lambda_handler(event, context):
     else:
         body = json.dumps(body)
 
-    return { 
-        'statusCode': 200,
-        'isBase64Encoded': 'false',
-        'headers': headers,
-        'body': body
-    }
+    # compress larger responses if the client accepts it
+    # (API Gateway needs binary media types set to */* to pass this through)
+    headers['Vary'] = 'Accept-Encoding'
+    if len(body) >= GZIP_MIN_SIZE and accepts_gzip(event):
+        headers['Content-Encoding'] = 'gzip'
+        response = {
+            'statusCode': 200,
+            'isBase64Encoded': True,
+            'headers': headers,
+            'body': base64.b64encode(gzip.compress(body.encode('UTF-8'), compresslevel=GZIP_LEVEL)).decode('UTF-8')
+        }
+    else:
+        response = { 
+            'statusCode': 200,
+            'isBase64Encoded': 'false',
+            'headers': headers,
+            'body': body
+        }
+
+    global first_request
+    if first_request:
+        first_request = False
+        if os.environ.get("AWS_LAMBDA_FUNCTION_NAME"):
+            report_cold_start(elapsed_ms(start))
+    return response
 
 
 def ifprint(key, dictionary, padding="  ", label=None):
@@ -309,14 +1507,87 @@ def ifprint(key, dictionary, padding="  ", label=None):
             label = key
         print(f"{padding}{label}: {dictionary[key]}")
 
+def print_report(results, show_cert=False):
+    """Print the formatted text output for the results of process()"""
+    print(f"connection: {results['connection']['protocol']} {results['connection']['bits']} bits using {results['connection']['cipher']}")
+    print(f"CA Trust File: {results['cafile']}")
+
+    for depth, cert in results['certs'].items():
+        extra_attr=[] # indicate sent from server, in local trust store, etc.
+        if cert['fromServer']:
+            extra_attr.append("sent by server")
+        if cert['trusted']:
+            extra_attr.append("in local CA trust store")
+        if extra_attr:
+            extra_attr_str = f" ({', '.join(extra_attr)})"
+        else:
+            extra_attr_str = ""
+
+        try:
+            print(f"\n{depth}{extra_attr_str} {cert['validation']}")
+        except KeyError:
+            print(f"\n{depth}{extra_attr_str}")
+        if 'revocation' in cert:
+            print(f"  revocation: {cert['revocation']['status']} ({cert['revocation'].get('source') or '; '.join(cert['revocation']['errors'])})")
+
+        # ifprint('trusted',cert)
+        ifprint("subject", cert)
+        ifprint("issuer", cert)
+        ifprint("notBefore", cert)
+        ifprint("notAfter", cert)
+        ifprint("subjectAltName", cert)
+        ifprint('keyUsage',cert)
+        ifprint('extendedKeyUsage',cert)
+        ifprint('basicConstraints',cert)
+        ifprint('serialnumber',cert)
+        ifprint('signature_algorithm', cert)
+        ifprint('SHA-1 fingerprint',cert, label="fingerprint")
+        ifprint('subjectKeyIdentifier',cert)
+        ifprint('authorityKeyIdentifier',cert)
+        if show_cert:
+            print(f"\n{cert['cert']}")
+
+    if 'enumeration' in results:
+        enumeration = results['enumeration']
+        print(f"\nenumeration: {enumeration['handshakes']} handshakes in {enumeration['elapsed']} ms")
+        for protocol, ciphers in enumeration['protocols'].items():
+            print(f"  {protocol}: {', '.join(ciphers)}")
+        for protocol in enumeration['rejected']:
+            print(f"  {protocol}: not accepted")
+        for error in enumeration['errors']:
+            print(f"  error: {error}")
+
+
 def main():
     """Command-line interface"""
+    import argparse
     parser = argparse.ArgumentParser(description='cert-inspection inputs')
     parser.add_argument('-s','--servername', help='Server name if SNI is needed', default=None)
     parser.add_argument('-j','--json', help='Print json output', action='store_true', default=False)
     parser.add_argument('-c','--cert', help='Print out cert if formatted text output (included in json by default, omitted in formatted text output by default)', action='store_true', default=False)
+    parser.add_argument('-t','--timeout', help=f'Deadline in seconds for each scan (default {SCAN_TIMEOUT})', type=float, default=SCAN_TIMEOUT)
+    parser.add_argument('-a','--all-addresses', help='Scan every IPv4 and IPv6 address of the target', action='store_true', default=False)
+    parser.add_argument('-r','--revocation', help='Check whether the certs have been revoked, by OCSP or CRL', action='store_true', default=False)
+    parser.add_argument('-e','--enumerate', help='Also list every TLS version and cipher the target accepts', action='store_true', default=False)
+    parser.add_argument('-b','--bulk', help='Scan the targets listed in this file ("-" for stdin), writing one json result per line', default=None)
+    parser.add_argument('-w','--workers', help=f'Number of concurrent scans in bulk mode (default {BULK_WORKERS}, or {ASYNC_CONCURRENCY} with --async)', type=int, default=None)
+    parser.add_argument('--async', help='Use the asyncio scan engine in bulk mode', dest='use_async', action='store_true', default=False)
+    parser.add_argument('--per-host', help=f'Maximum concurrent scans of any one host with --async (default {ASYNC_PER_HOST})', type=int, default=ASYNC_PER_HOST)
     args, other_input = parser.parse_known_args()
 
+    if args.bulk:
+        if args.bulk == '-':
+            f = sys.stdin
+        else:
+            f = open(args.bulk, "r", encoding="utf8")
+        with f:
+            if args.use_async:
+                import asyncio
+                asyncio.run(bulk_process_async(read_targets(f), concurrency=args.workers or ASYNC_CONCURRENCY, per_host=args.per_host, timeout=args.timeout))
+            else:
+                bulk_process(read_targets(f), workers=args.workers or BULK_WORKERS, timeout=args.timeout)
+        return
+
     # Get the main input (hostname, hostname:port, url with those)
     if len(other_input) < 1:
         raise SystemExit(f"""
@@ -328,6 +1599,10 @@ SYNTAX VARIANTS:
     {sys.argv[0]} [-j|--json] [-c|--cert] [-s <servername>] hostname
     {sys.argv[0]} [-j|--json] [-c|--cert] [-s <servername>] hostname:port
     {sys.argv[0]} [-j|--json] [-c|--cert] [-s <servername>] url
+    {sys.argv[0]} [-j|--json] [-c|--cert] [-s <servername>] -r|--revocation hostname[:port]
+    {sys.argv[0]} [-j|--json] [-c|--cert] [-s <servername>] -e|--enumerate hostname[:port]
+    {sys.argv[0]} [-j|--json] [-c|--cert] [-s <servername>] [-t <seconds>] -a|--all-addresses hostname[:port]
+    {sys.argv[0]} -b <file|-> [-w <workers>] [--async [--per-host <n>]]
 
   General use is to just give a hostname or URL.  Port 443 is assumed if not specified, and
   these will be picked out of a URL if a URL is supplied.
@@ -343,6 +1618,26 @@ SYNTAX VARIANTS:
 
   The -c switch signals that the cert should be printed out in the formatted text output.  It is
   normally omitted for a cleaner report.  The json output always includes it.
+
+  The -t <seconds> switch sets the deadline for each scan (default {SCAN_TIMEOUT}), DNS lookup included.
+  The TCP connect and the TLS handshake are also limited to {CONNECT_TIMEOUT} and {HANDSHAKE_TIMEOUT} seconds respectively.
+
+  The -a switch scans every IPv4 and IPv6 address the hostname resolves to, in parallel, and
+  reports whether they all presented the same chain, eg. to find a node behind round-robin DNS
+  that is still serving an old cert.
+
+  The -r switch also checks whether the certs have been revoked, using the OCSP response the
+  server staples to the handshake, else the OCSP responder or CRL named in each cert.
+
+  The -e switch also lists every TLS version and cipher the target accepts, probing them over
+  up to {ENUM_BUDGET} connections at once.
+
+  The -b <file> switch scans every target listed in the file (or stdin if "-"), one per line in the
+  form "hostname[:port] [servername]" or "url [servername]".  Targets are scanned concurrently by
+  -w <workers> threads, and each result is printed as a single line of json as soon as it finishes.
+  With --async, the scans are run by an asyncio event loop instead, which can keep thousands of
+  handshakes in flight at once; -w then sets the number in flight, and --per-host limits how many
+  of those go to any one host.
 """)
 
     hostname, port = get_host_port_from_input(other_input[0])
@@ -350,7 +1645,12 @@ SYNTAX VARIANTS:
     if args.servername:
         servername = args.servername
 
-    results = process(hostname, port, servername)
+    if args.all_addresses:
+        results = process_all_addresses(hostname, port, servername, timeout=args.timeout)
+    else:
+        results = process(hostname, port, servername, timeout=args.timeout, check_revocation=args.revocation)
+        if args.enumerate:
+            results['enumeration'] = enumerate_tls(hostname, port, servername)
 
     if args.json:
         print(json.dumps(results, indent=4))
@@ -360,42 +1660,29 @@ SYNTAX VARIANTS:
             print(f"cert-inspection: {servername} on {hostname}:{port}\n")
         else:
             print(f"cert-inspection: {hostname}:{port}\n")
-        print(f"connection: {results['connection']['protocol']} {results['connection']['bits']} bits using {results['connection']['cipher']}")
-        print(f"CA Trust File: {results['cafile']}")
-
-        for depth, cert in results['certs'].items():
-            extra_attr=[] # indicate sent from server, in local trust store, etc.
-            if cert['fromServer']:
-                extra_attr.append("sent by server")
-            if cert['trusted']:
-                extra_attr.append("in local CA trust store")
-            if extra_attr:
-                extra_attr_str = f" ({', '.join(extra_attr)})"
+        if args.all_addresses:
+            for address, address_results in results['addresses'].items():
+                print(f"===== address: {address}")
+                if 'error' in address_results:
+                    print(f"error: {address_results['error']}\n")
+                    continue
+                print_report(address_results, args.cert)
+                print("")
+            if results['summary']['identical']:
+                print(f"All {results['summary']['addresses']} addresses presented the same chain")
             else:
-                extra_attr_str = ""
-
-            try:
-                print(f"\n{depth}{extra_attr_str} {cert['validation']}")
-            except KeyError:
-                print(f"\n{depth}{extra_attr_str}")
-
-            # ifprint('trusted',cert)
-            ifprint("subject", cert)
-            ifprint("issuer", cert)
-            ifprint("notBefore", cert)
-            ifprint("notAfter", cert)
-            ifprint("subjectAltName", cert)
-            ifprint('keyUsage',cert)
-            ifprint('extendedKeyUsage',cert)
-            ifprint('basicConstraints',cert)
-            ifprint('serialnumber',cert)
-            ifprint('signature_algorithm', cert)
-            ifprint('SHA-1 fingerprint',cert, label="fingerprint")
-            ifprint('subjectKeyIdentifier',cert)
-            ifprint('authorityKeyIdentifier',cert)
-            if args.cert:
-                print(f"\n{cert['cert']}")
+                print(f"The {results['summary']['addresses']} addresses did NOT all present the same chain:")
+                for chain in results['summary']['chains']:
+                    print(f"  {', '.join(chain['addresses'])}: {' <- '.join(chain['fingerprints'])}")
+                for address in results['summary']['errors']:
+                    print(f"  {address}: error")
+        else:
+            print_report(results, args.cert)
 
+if os.environ.get("AWS_LAMBDA_FUNCTION_NAME"):
+    # In lambda, warm up during the init phase, rather than in the first request
+    warm_up()
+init_duration = elapsed_ms(INIT_START)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Continuously monitor a list of targets, rechecking each one more or less often depending on how
+close its cert is to expiry, and printing an alert (one line of json) when something changes:
+    expiry      the leaf cert has crossed one of the ALERT_DAYS thresholds
+    changed     the server presented a different leaf cert
+    validation  the validation results of the chain changed
+    failure     the scan failed FAILURE_ALERT times in a row
+    recovered   a scan succeeded after a failure alert
+    invalid     the line in the targets file could not be parsed; the target is skipped
+
+Targets are kept in a priority queue ordered by when they are next due.  The recheck interval
+comes from RECHECK_INTERVALS by days left until notAfter, and after a failed scan it backs off
+from FAILURE_INTERVAL, doubling up to MAX_FAILURE_INTERVAL.  Handshakes are limited to --rate per
+second overall, and each host is scanned no more than once every --host-interval seconds.
+
+Syntax:
+    ./monitor.py [-w <workers>] [--rate <per second>] [--host-interval <seconds>] [--resume] [-o <alerts file>] <targets file>
+
+The targets file has the same format as the main.py -b input: "hostname[:port] [servername]" or
+"url [servername]" per line.
+"""
+
+import sys
+import json
+import time
+import heapq
+import queue
+import random
+import argparse
+import datetime
+import threading
+import concurrent.futures
+
+import main
+
+# (days left less than, recheck interval in seconds), in order; None matches anything
+RECHECK_INTERVALS = [
+    (1, 5 * 60),
+    (7, 15 * 60),
+    (30, 60 * 60),
+    (60, 6 * 60 * 60),
+    (None, 24 * 60 * 60),
+]
+# spread rechecks by up to this fraction of the interval, so targets added together drift apart
+JITTER = 0.1
+# after a failed scan, retry after this many seconds, doubling for each failure in a row
+FAILURE_INTERVAL = 60
+MAX_FAILURE_INTERVAL = 60 * 60
+# alert after this many failures in a row
+FAILURE_ALERT = 3
+# alert as the leaf cert's days left drops below each of these
+ALERT_DAYS = [30, 14, 7, 3, 1, 0]
+
+WORKERS = 16
+RATE = 10            # handshakes per second, overall
+HOST_INTERVAL = 5    # seconds between scans of the same host
+
+# only the details the monitor looks at
+FIELDS = frozenset(['notAfter', 'SHA-1 fingerprint'])
+
+class Target:
+    """A monitored target and what was seen the last time it was scanned"""
+    def __init__(self, line: str):
+        self.line = line
+        self.hostname, self.port, self.servername = main.parse_target(line)
+        self.failures = 0
+        self.fingerprint = None
+        self.validation = None
+        self.threshold = None  # lowest ALERT_DAYS threshold alerted for the current cert
+
+class RateLimiter:
+    """Token bucket allowing rate events per second, in bursts of up to burst"""
+    def __init__(self, rate: float, burst: float = None):
+        self.rate = rate
+        self.burst = burst or max(1, rate)
+        self.tokens = self.burst
+        self.last = time.monotonic()
+
+    def wait(self):
+        """Seconds until an event is allowed, or 0 after taking a token"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+def days_left(not_after: str):
+    """Days until a notAfter date, as formatted by main.get_date_from_asn1()"""
+    expiry = datetime.datetime.strptime(not_after, "%a %b %d %H:%M:%S %Y GMT").replace(tzinfo=datetime.timezone.utc)
+    return (expiry - datetime.datetime.now(datetime.timezone.utc)).total_seconds() / 86400
+
+def recheck_interval(days: float):
+    """Seconds until the next scan of a cert with days left until expiry"""
+    for limit, interval in RECHECK_INTERVALS:
+        if limit is None or days < limit:
+            return interval * (1 + random.uniform(-JITTER, JITTER))
+
+def alert(out, kind: str, line: str, **details):
+    out.write(json.dumps({
+        'time': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'alert': kind,
+        'target': line,
+        **details
+    }) + "\n")
+    out.flush()
+
+def check_results(target: Target, results: dict, out):
+    """Compare a successful scan with the previous one, alerting on changes
+    Returns the seconds until the target should be scanned again.
+    """
+    if target.failures >= FAILURE_ALERT:
+        alert(out, 'recovered', target.line, failures=target.failures)
+    target.failures = 0
+
+    leaf = results['certs'][0]
+    days = days_left(leaf['notAfter'])
+    validation = [cert.get('validation', "") for cert in results['certs'].values()]
+
+    if target.fingerprint and leaf['SHA-1 fingerprint'] != target.fingerprint:
+        alert(out, 'changed', target.line, previous=target.fingerprint, fingerprint=leaf['SHA-1 fingerprint'], notAfter=leaf['notAfter'])
+        target.threshold = None
+    if target.validation is not None and validation != target.validation:
+        alert(out, 'validation', target.line, previous=target.validation, validation=validation)
+    target.fingerprint = leaf['SHA-1 fingerprint']
+    target.validation = validation
+
+    crossed = [threshold for threshold in ALERT_DAYS if days < threshold]
+    if crossed and (target.threshold is None or min(crossed) < target.threshold):
+        target.threshold = min(crossed)
+        alert(out, 'expiry', target.line, days=round(days, 2), threshold=target.threshold, notAfter=leaf['notAfter'])
+
+    return recheck_interval(days)
+
+def check_failure(target: Target, error: str, out):
+    """Record a failed scan, alerting once it has failed FAILURE_ALERT times in a row
+    Returns the seconds until the target should be scanned again.
+    """
+    target.failures += 1
+    if target.failures == FAILURE_ALERT:
+        alert(out, 'failure', target.line, failures=target.failures, error=error)
+    return min(MAX_FAILURE_INTERVAL, FAILURE_INTERVAL * 2 ** (target.failures - 1))
+
+def monitor(targets, out=sys.stdout, workers: int = WORKERS, rate: float = RATE, host_interval: float = HOST_INTERVAL, stop: threading.Event = None, resume: bool = False):
+    """Scan targets forever (or until stop is set), each as it falls due
+    resume resumes TLS sessions where the server allows, see main.process(); a
+    changed cert is then only noticed on the next full handshake.
+    """
+    stop = stop or threading.Event()
+    limiter = RateLimiter(rate)
+    done = queue.Queue()   # (target, results, error) from the workers
+    host_last = {}         # hostname -> time.monotonic() of its last scan
+    in_flight = 0
+    seq = 0                # tie breaker, so the heap never compares Targets
+
+    # everything is due now, in input order
+    now = time.monotonic()
+    heap = []
+    for seq, line in enumerate(targets):
+        try:
+            heap.append((now, seq, Target(line)))
+        except (ValueError, IndexError) as exc:
+            # one bad line shouldn't stop the rest of the inventory being monitored
+            alert(out, 'invalid', line, error=str(exc))
+    heapq.heapify(heap)
+
+    def scan(target):
+        try:
+            done.put((target, main.process(target.hostname, target.port, target.servername, fields=FIELDS, resume=resume), None))
+        except Exception as exc:
+            done.put((target, None, str(exc)))
+
+    def reschedule(target, results, error):
+        nonlocal in_flight, seq
+        in_flight -= 1
+        if error:
+            interval = check_failure(target, error, out)
+        else:
+            interval = check_results(target, results, out)
+        seq += 1
+        heapq.heappush(heap, (time.monotonic() + interval, seq, target))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        wait = 0
+        while not stop.is_set():
+            # reschedule the targets that have finished, waiting up to wait seconds for the first
+            try:
+                item = done.get(timeout=wait)
+                while True:
+                    reschedule(*item)
+                    item = done.get_nowait()
+            except queue.Empty:
+                pass
+
+            # start whatever is due, working out how long until the next one can start
+            wait = 1
+            while heap and in_flight < workers:
+                due, target_seq, target = heap[0]
+                now = time.monotonic()
+                if due > now:
+                    wait = min(wait, due - now)
+                    break
+                polite = host_last.get(target.hostname, -host_interval) + host_interval
+                if polite > now:
+                    # too soon for this host; put it back for when it is allowed
+                    heapq.heapreplace(heap, (polite, target_seq, target))
+                    continue
+                wait = limiter.wait()
+                if wait:
+                    break
+                heapq.heappop(heap)
+                host_last[target.hostname] = now
+                in_flight += 1
+                executor.submit(scan, target)
+
+def cli():
+    parser = argparse.ArgumentParser(description='Continuously monitor certs, alerting on expiry and changes')
+    parser.add_argument('targets', help='File listing the targets, one per line ("-" for stdin)')
+    parser.add_argument('-w','--workers', help=f'Concurrent scans (default {WORKERS})', type=int, default=WORKERS)
+    parser.add_argument('--rate', help=f'Maximum handshakes per second (default {RATE})', type=float, default=RATE)
+    parser.add_argument('--host-interval', help=f'Minimum seconds between scans of the same host (default {HOST_INTERVAL})', type=float, default=HOST_INTERVAL)
+    parser.add_argument('--resume', help='Resume TLS sessions on rechecks, within main.SESSION_CACHE_TTL', action='store_true', default=False)
+    parser.add_argument('-o','--output', help='Append alerts to this file (default stdout)', default=None)
+    args = parser.parse_args()
+
+    if args.targets == '-':
+        targets = list(main.read_targets(sys.stdin))
+    else:
+        with open(args.targets, "r", encoding="utf8") as f:
+            targets = list(main.read_targets(f))
+
+    out = sys.stdout
+    if args.output:
+        out = open(args.output, "a", encoding="utf8")
+    try:
+        monitor(targets, out, args.workers, args.rate, args.host_interval, resume=args.resume)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    cli()
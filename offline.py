@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Verify certificate chains from files, without connecting to anything, giving the same per-cert
+details as a scan.  Parsing and verification are spread over a pool of processes, each with its
+own copy of the X509Store (built once, when the process starts) and the trust index.
+
+Each input is a file or a directory (searched recursively).  A file holds a chain, leaf first, as
+PEM (one or more certs) or as a single DER cert.  With --each, every cert is verified as a leaf of
+its own instead, eg. for a dump of certs from a secret store; --intermediates gives a bundle of
+intermediates to build the chains from.
+
+Syntax:
+    ./offline.py [-w <workers>] [--each] [-i <intermediates>] [--cafile <file>] [--fields <list>] <file|dir> ...
+
+Each chain is written as a line of json, with the input as "source" and either "results" (with
+"certs" as in the main.py -j output) or "error".  Lines are written in the order the chunks of
+input finish, not the order of the input.
+"""
+
+import os
+import re
+import sys
+import json
+import argparse
+import concurrent.futures
+from OpenSSL import crypto
+
+import main
+
+WORKERS = os.cpu_count() or 4
+CHUNK_SIZE = 256        # chains sent to a worker at a time
+
+PEM_CERT = re.compile(rb'-----BEGIN CERTIFICATE-----.+?-----END CERTIFICATE-----', re.DOTALL)
+
+# per worker process, set up by init_worker()
+store = None
+intermediates = []
+fields = None
+
+def init_worker(cafile: str, intermediates_file: str = None, worker_fields: frozenset = None):
+    """Build the process's X509Store and load the trust index, once per worker"""
+    global store, intermediates, fields
+    store = crypto.X509Store()
+    store.load_locations(cafile)
+    if intermediates_file:
+        with open(intermediates_file, "rb") as f:
+            intermediates = [load_cert(blob) for blob in split_certs(f.read())]
+    fields = worker_fields
+    main.get_trust_store()
+
+def split_certs(contents: bytes):
+    """The certs in a file's contents, as PEM blobs, or the whole file if it is DER"""
+    blobs = PEM_CERT.findall(contents)
+    if blobs or b'-----BEGIN' in contents:
+        return blobs
+    return [contents]
+
+def load_cert(blob: bytes):
+    if blob.startswith(b'-----BEGIN'):
+        return crypto.load_certificate(crypto.FILETYPE_PEM, blob)
+    return crypto.load_certificate(crypto.FILETYPE_ASN1, blob)
+
+def verify_cert(verify_store, cert, untrusted):
+    """The (errnum, error depth, message) of verifying cert against verify_store,
+    building the chain from the untrusted certs, or None if it verifies
+    """
+    context = crypto.X509StoreContext(verify_store, cert, chain=untrusted)
+    try:
+        context.verify_certificate()
+    except crypto.X509StoreContextError as exc:
+        return exc.errors
+    return None
+
+def verify_chain(chain):
+    """Verify a chain, leaf first, against the store
+    Returns the validation results by depth, in the format main.verify() gives
+    them.  Verification stops at the first error, so each cert is verified as
+    the leaf of its own part of the chain, and gets the error found at its own
+    depth, if any.  If that part of the chain fails further up, before the
+    cert's own checks are reached, the cert is checked again with the certs
+    above it trusted, so eg. a leaf under an unknown root is still reported ok
+    (or expired), as a scan reports it.
+    """
+    verified = {}
+    for depth, cert in enumerate(chain):
+        untrusted = chain[depth + 1:] + intermediates
+        error = verify_cert(store, cert, untrusted)
+        if error and error[1] > 0 and untrusted:
+            partial = crypto.X509Store()
+            partial.set_flags(crypto.X509StoreFlags.PARTIAL_CHAIN)
+            for issuer in untrusted:
+                partial.add_cert(issuer)
+            error = verify_cert(partial, cert, [])
+        if error and error[1] == 0:
+            errnum, error_depth, message = error
+            verified[depth] = f"verify:depth:{depth} - {errnum}: {main.VALIDATE_ERROR.get(errnum, message)}"
+        else:
+            verified[depth] = f"verify:depth:{depth} - 0: ok"
+    return verified
+
+def process_chain(source: str, blobs, error: str = None):
+    """A record for one chain, suitable for NDJSON output"""
+    record = {'source': source}
+    try:
+        if error:
+            raise ValueError(error)
+        chain = [load_cert(blob) for blob in blobs]
+        if not chain:
+            raise ValueError("No certificates found")
+        results = {'certs': {}}
+        main.add_chain_details(results, chain, verify_chain(chain), fields)
+        record['results'] = results
+    except Exception as exc:
+        record['error'] = str(exc)
+    return record
+
+def process_chunk(chunk):
+    """Process a chunk of (source, blobs, error) chains in a worker, returning the json lines"""
+    return [json.dumps(process_chain(*chain)) for chain in chunk]
+
+def find_files(paths):
+    """The files named, and those under the directories named, in order"""
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                for filename in sorted(filenames):
+                    yield os.path.join(dirpath, filename)
+        else:
+            yield path
+
+def read_chains(paths, each: bool = False):
+    """Generate (source, blobs, error) for every chain in the files, reading one file at a time"""
+    for path in find_files(paths):
+        try:
+            with open(path, "rb") as f:
+                blobs = split_certs(f.read())
+        except OSError as exc:
+            yield path, [], str(exc)
+            continue
+        if each:
+            for idx, blob in enumerate(blobs):
+                yield f"{path}#{idx}", [blob], None
+        else:
+            yield path, blobs, None
+
+def chunks(chains, size: int = CHUNK_SIZE):
+    chunk = []
+    for chain in chains:
+        chunk.append(chain)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def verify_all(paths, out=sys.stdout, workers: int = WORKERS, each: bool = False, cafile: str = None, intermediates_file: str = None, fields: frozenset = None):
+    """Verify every chain in paths on a pool of processes, writing one line of json per chain
+    The input is read a chunk at a time, with no more than two chunks per worker
+    waiting, so any number of certs can be streamed through.  Returns the number
+    of chains.
+    """
+    count = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(cafile or main.default_cafile(), intermediates_file, fields)) as executor:
+        pending = set()
+        for chunk in chunks(read_chains(paths, each)):
+            pending.add(executor.submit(process_chunk, chunk))
+            if len(pending) >= workers * 2:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                count += write_lines(done, out)
+        count += write_lines(pending, out)
+    return count
+
+def write_lines(futures, out):
+    count = 0
+    for future in futures:
+        lines = future.result()
+        if lines:
+            out.write("\n".join(lines) + "\n")
+        count += len(lines)
+    out.flush()
+    return count
+
+def cli():
+    parser = argparse.ArgumentParser(description='Verify certificate chains from files, offline')
+    parser.add_argument('paths', help='PEM or DER files, or directories of them', nargs='+')
+    parser.add_argument('-w','--workers', help=f'Worker processes (default {WORKERS})', type=int, default=WORKERS)
+    parser.add_argument('--each', help='Verify every cert as a leaf of its own, rather than each file as a chain', action='store_true', default=False)
+    parser.add_argument('-i','--intermediates', help='PEM bundle of intermediates to build chains from', default=None)
+    parser.add_argument('--cafile', help='CA bundle to verify against (default as for main.py)', default=None)
+    parser.add_argument('--fields', help='Comma separated list of the cert details to include', default=None)
+    parser.add_argument('--profile', help='Named set of cert details to include (summary or full)', default=None)
+    args = parser.parse_args()
+
+    count = verify_all(args.paths, workers=args.workers, each=args.each, cafile=args.cafile,
+        intermediates_file=args.intermediates, fields=main.get_fields(args.fields, args.profile))
+    print(f"verified {count} chains", file=sys.stderr)
+
+if __name__ == '__main__':
+    cli()
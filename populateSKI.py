@@ -1,22 +1,36 @@
 #!/usr/bin/env python3
 # from:
 #   - https://www.pyopenssl.org/en/stable/index.html
-# open the ca file, process each cert, write to ski_dir/<subject pub key identifier>
-# If the SKI does not exist, serialize the Subject DN (change / to +++, () and / within text changed to |) and write that
+# open the ca file (and any extra bundles given), process each cert, and write them all into a single
+# indexed file, trust_index.bin, that main.py loads in one read.  Each cert is indexed by its subject key
+# identifier, if it has one, and by its serialized Subject DN (change / to +++, () and / within text changed to |)
+#
+# The index file layout is:
+#   8 bytes   magic, TRUST_INDEX_MAGIC
+#   4 bytes   length of the json header, big-endian
+#   header    json: {"source": <sha256 of the input bundles>, "entries": [[ski or null, serialized dn, offset, length], ...]}
+#   blobs     the DER encoded certs, at offset (from the end of the header) for length bytes
+#
+# All the certs are also written to trust_bundle.pem, which main.py verifies against, so that any
+# private CAs are trusted for verification too.
+#
+# The index is only rebuilt if the input bundles have changed since it was written, unless -f is given.
 
 import re
+import json
+import struct
+import hashlib
+import argparse
 from OpenSSL import crypto
 import certifi
-from cryptography.hazmat.primitives.serialization import Encoding
 import os
 
 THISFILE=os.path.abspath(__file__)
 CWD=os.path.dirname(THISFILE)
 
-ski_dir=f"{CWD}/subjectKeyIdentifier"
-cafile=certifi.where()
-if not os.path.exists(ski_dir):
-    os.mkdir(ski_dir, 0o755)
+TRUST_INDEX=f"{CWD}/trust_index.bin"
+TRUST_INDEX_MAGIC=b"CERTIDX1"
+TRUST_BUNDLE=f"{CWD}/trust_bundle.pem"
 
 def serialized_dn(tuple_list):
     """Serialize a list of tuples into a string
@@ -34,27 +48,84 @@ def get_ca_certs(cafile):
     regex = re.compile(r'(-----BEGIN CERTIFICATE-----[^-]+-----END CERTIFICATE-----)', re.DOTALL)
     return regex.findall(contents)
 
-
-for cert_pem in get_ca_certs(cafile):
-    print(cert_pem)
-    cert = crypto.load_certificate(type = crypto.FILETYPE_PEM, buffer = cert_pem)
-    ski=None
-    for i in range(0,cert.get_extension_count()-1):
+def get_ski(cert):
+    """The subject key identifier of a cert, or None"""
+    for i in range(0,cert.get_extension_count()):
         try:
             ext=cert.get_extension(i)
-            name = ext.get_short_name().decode('UTF-8')
-            if name == "subjectKeyIdentifier":
-                ski = str(ext)
-            # print(f"  {ext.get_short_name().decode('UTF-8')}: {ext}")
+            if ext.get_short_name().decode('UTF-8') == "subjectKeyIdentifier":
+                return str(ext)
         except:
             pass
-    
-    if ski:
-        file = f"{ski_dir}/{ski}"
-    else:
-        file = f"{ski_dir}/{serialized_dn(cert.get_subject().get_components())}"
-    with open(file, "w", encoding="utf8") as f:
-        f.write(cert_pem)
-        f.close()
-    print(file)
-    
+    return None
+
+def source_hash(cafiles):
+    """Hash of the contents of the input bundles, to tell if the index is out of date"""
+    digest = hashlib.sha256(TRUST_INDEX_MAGIC)
+    for cafile in cafiles:
+        with open(cafile, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+def read_index_source(index_file):
+    """The source hash recorded in an existing index file, or None"""
+    try:
+        with open(index_file, "rb") as f:
+            if f.read(len(TRUST_INDEX_MAGIC)) != TRUST_INDEX_MAGIC:
+                return None
+            header_len = struct.unpack(">I", f.read(4))[0]
+            return json.loads(f.read(header_len))["source"]
+    except (OSError, ValueError, KeyError, struct.error):
+        return None
+
+def build_index(cafiles, source):
+    """Build the contents of the index file, and of the merged bundle, from the certs in the input bundles"""
+    entries = []
+    blobs = []
+    pems = []
+    offset = 0
+    seen = set()
+    for cafile in cafiles:
+        for cert_pem in get_ca_certs(cafile):
+            cert = crypto.load_certificate(type = crypto.FILETYPE_PEM, buffer = cert_pem)
+            der = crypto.dump_certificate(type = crypto.FILETYPE_ASN1, cert = cert)
+            if der in seen:
+                continue # same cert in more than one bundle
+            seen.add(der)
+            ski = get_ski(cert)
+            dn = serialized_dn(cert.get_subject().get_components())
+            entries.append([ski, dn, offset, len(der)])
+            blobs.append(der)
+            pems.append(cert_pem)
+            offset += len(der)
+            print(f"{ski or '-'} {dn}")
+
+    header = json.dumps({"source": source, "entries": entries}).encode('UTF-8')
+    return TRUST_INDEX_MAGIC + struct.pack(">I", len(header)) + header + b"".join(blobs), "\n".join(pems) + "\n", len(entries)
+
+def main():
+    parser = argparse.ArgumentParser(description=f'Build the trust store index {TRUST_INDEX} from the certifi CA bundle')
+    parser.add_argument('bundles', help='Extra PEM bundles to include, eg. private CAs', nargs='*')
+    parser.add_argument('-f','--force', help='Rebuild even if the bundles have not changed', action='store_true', default=False)
+    parser.add_argument('-o','--output', help=f'Index file to write (default {TRUST_INDEX})', default=TRUST_INDEX)
+    parser.add_argument('-b','--bundle', help=f'Merged CA bundle to write (default {TRUST_BUNDLE})', default=TRUST_BUNDLE)
+    args = parser.parse_args()
+
+    cafiles = [certifi.where()] + args.bundles
+    source = source_hash(cafiles)
+    if not args.force and read_index_source(args.output) == source and os.path.exists(args.bundle):
+        print(f"{args.output} is up to date")
+        return
+
+    contents, bundle, count = build_index(cafiles, source)
+    # write to temporary files and rename, so a running scan never sees half an index
+    with open(f"{args.bundle}.tmp", "w", encoding="utf8") as f:
+        f.write(bundle)
+    os.replace(f"{args.bundle}.tmp", args.bundle)
+    with open(f"{args.output}.tmp", "wb") as f:
+        f.write(contents)
+    os.replace(f"{args.output}.tmp", args.output)
+    print(f"{args.output}: {count} certs from {', '.join(cafiles)}")
+
+if __name__ == '__main__':
+    main()
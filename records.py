@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+A compact in-memory model of scan results, for holding the results of a large inventory in one
+process, eg. to report on or diff them.
+
+The results from main.process() are nested dicts in which every cert repeats its DNs, extension
+text and PEM, and every endpoint its copy of the intermediates and root.  Here each endpoint is an
+EndpointResult and each cert a CertRecord, both with __slots__; a cert is held once, by
+fingerprint, however many endpoints present it, and the strings that repeat across certs and
+endpoints (DNs, dates, validation results, the CA file, ciphers) are interned.  A cert keeps its
+DER encoding rather than the PEM and extension strings, which are worked out again only when
+to_dict() needs them.
+
+to_dict() gives back the results in the same format as main.process(), so the json is unchanged
+for lambda_handler and the UI, and EndpointResult.to_record() gives back the line of main.py -b
+output it was loaded from, "scanned_at" included.
+
+Syntax:
+    ./records.py <bulk output file>
+
+loads the output of a bulk scan ("-" for stdin) and prints how many endpoints and distinct certs
+it holds.
+"""
+
+import sys
+import ssl
+import json
+import hashlib
+from OpenSSL import crypto
+
+import main
+
+# the cert details that are not extensions, by slot name, in the order parse_cert_details() adds them
+CERT_SLOTS = {
+    'subject': 'subject',
+    'serialized_subject': 'serialized_subject',
+    'issuer': 'issuer',
+    'notBefore': 'notBefore',
+    'notAfter': 'notAfter',
+    'expired': 'expired',
+    'SHA-1 fingerprint': 'fingerprint',
+    'serialnumber': 'serialnumber',
+    'version': 'version',
+    'signature_algorithm': 'signature_algorithm',
+}
+# the cert details that repeat across certs, so are worth interning
+INTERNED_FIELDS = frozenset(['subject', 'serialized_subject', 'issuer', 'notBefore', 'notAfter', 'signature_algorithm'])
+# the per-connection details of a cert in a chain, see ChainEntry
+ENTRY_FIELDS = frozenset(['validation', 'fromServer', 'trusted'])
+# the connection section of the results, in the order get_connection_details() gives it
+CONNECTION_FIELDS = ('hostname', 'port', 'address', 'servername', 'cipher', 'protocol', 'bits', 'resumed')
+
+def intern(value):
+    """value, interned if it is a string"""
+    if isinstance(value, str):
+        return sys.intern(value)
+    return value
+
+def fingerprint(der: bytes):
+    """The SHA-1 fingerprint of a DER encoded cert, formatted as X509.digest() does"""
+    digest = hashlib.sha1(der).hexdigest().upper()
+    return ":".join(digest[i:i + 2] for i in range(0, len(digest), 2))
+
+class CertRecord:
+    """The details of a cert, as given by main.get_cert_details(), held once per inventory
+    keys is the names of the details, in order.  If the PEM was included the
+    DER is kept instead of it, and the extension strings are dropped; both are
+    worked out from the DER by to_dict().  Otherwise the extension strings are
+    kept, in order, in extensions.
+    """
+    __slots__ = ('keys', 'der', 'extensions') + tuple(CERT_SLOTS.values())
+
+    def __init__(self, details: dict, keys: tuple):
+        self.keys = keys
+        self.der = None
+        self.extensions = None
+        extensions = []
+        for key, value in details.items():
+            if key in CERT_SLOTS:
+                setattr(self, CERT_SLOTS[key], intern(value) if key in INTERNED_FIELDS else value)
+            elif key == 'cert':
+                self.der = ssl.PEM_cert_to_DER_cert(value)
+            else:
+                extensions.append(value)
+        if self.der is None and extensions:
+            self.extensions = tuple(extensions)
+
+    def get_fingerprint(self):
+        """The SHA-1 fingerprint, or None if neither it nor the PEM was included"""
+        if 'SHA-1 fingerprint' in self.keys:
+            return self.fingerprint
+        if self.der is not None:
+            return fingerprint(self.der)
+        return None
+
+    def extension_details(self):
+        """The extension strings, by short name, as parse_cert_details() gives them"""
+        if self.der is None:
+            names = [key for key in self.keys if key not in CERT_SLOTS and key != 'cert']
+            return dict(zip(names, self.extensions or ()))
+        cert = crypto.load_certificate(crypto.FILETYPE_ASN1, self.der)
+        extensions = {}
+        for i in range(cert.get_extension_count()):
+            try:
+                ext = cert.get_extension(i)
+                extensions[ext.get_short_name().decode('UTF-8')] = str(ext)
+            except Exception:
+                pass
+        if "keyid:" in extensions.get('authorityKeyIdentifier', ""):  # handle old syntax, as add_chain_details() does
+            extensions['authorityKeyIdentifier'] = extensions['authorityKeyIdentifier'][6:].split("\n")[0]
+        return extensions
+
+    def to_dict(self):
+        details = {}
+        extensions = None
+        for key in self.keys:
+            if key in CERT_SLOTS:
+                details[key] = getattr(self, CERT_SLOTS[key])
+            elif key == 'cert':
+                details[key] = ssl.DER_cert_to_PEM_cert(self.der)
+            else:
+                if extensions is None:
+                    extensions = self.extension_details()
+                details[key] = extensions.get(key)
+        return details
+
+class ChainEntry:
+    """A cert as presented in one endpoint's chain, with the results for that connection
+    extra holds any other per-connection details, eg. revocation.
+    """
+    __slots__ = ('cert', 'validation', 'fromServer', 'trusted', 'extra')
+
+    def __init__(self, cert: CertRecord, validation: str, fromServer: bool, trusted: bool, extra: dict = None):
+        self.cert = cert
+        self.validation = validation
+        self.fromServer = fromServer
+        self.trusted = trusted
+        self.extra = extra
+
+    def to_dict(self):
+        details = self.cert.to_dict()
+        if self.validation is not None:
+            details['validation'] = self.validation
+        details['fromServer'] = self.fromServer
+        details['trusted'] = self.trusted
+        if self.extra:
+            details.update(self.extra)
+        return details
+
+class EndpointResult:
+    """The results of a scan of one endpoint, or the error it failed with
+    scanned_at is when the scan started, from the -b output, if known.  timing
+    is a tuple of the values, in the order of timing_keys (which is shared).
+    extra holds any other sections of the results, eg. enumeration.
+    """
+    __slots__ = ('target', 'scanned_at', 'error', 'cafile', 'chain', 'timing_keys', 'timing', 'extra') + CONNECTION_FIELDS
+
+    def __init__(self, target: str = None, error: str = None, scanned_at: float = None):
+        self.target = target
+        self.scanned_at = scanned_at
+        self.error = error
+        self.cafile = None
+        self.chain = ()
+        self.timing_keys = None
+        self.timing = None
+        self.extra = None
+
+    def to_dict(self):
+        """The results, in the format main.process() gives them"""
+        if self.error is not None:
+            return None
+        results = {'certs': {idx: entry.to_dict() for idx, entry in enumerate(self.chain)}}
+        if self.cafile is not None:
+            results['cafile'] = self.cafile
+        if self.timing is not None:
+            results['timing'] = dict(zip(self.timing_keys, self.timing))
+        connection = {}
+        for name in CONNECTION_FIELDS:
+            try:
+                connection[name] = getattr(self, name)
+            except AttributeError:
+                pass
+        if connection:
+            results['connection'] = connection
+        if self.extra:
+            results.update(self.extra)
+        return results
+
+    def to_record(self):
+        """A line of the main.py -b output"""
+        record = {'target': self.target}
+        if self.scanned_at is not None:
+            record['scanned_at'] = self.scanned_at
+        if self.error is not None:
+            record['error'] = self.error
+        else:
+            record['results'] = self.to_dict()
+        return record
+
+class Inventory:
+    """The results of many endpoints, with each distinct cert held once"""
+    def __init__(self):
+        self.endpoints = []
+        self.certs = {}    # (fingerprint, keys) -> CertRecord
+        self.shared = {}   # tuples of names, so each is held once
+
+    def __len__(self):
+        return len(self.endpoints)
+
+    def __iter__(self):
+        return iter(self.endpoints)
+
+    def share(self, names: tuple):
+        return self.shared.setdefault(names, names)
+
+    def get_cert(self, details: dict):
+        """The CertRecord for a cert's details, shared with any endpoint that already presented it"""
+        cert = CertRecord(details, self.share(tuple(details)))
+        key = cert.get_fingerprint()
+        if key is None:
+            return cert  # nothing to match it by
+        return self.certs.setdefault((key, cert.keys), cert)
+
+    def add(self, results: dict, target: str = None, scanned_at: float = None):
+        """Add the results of a scan, as main.process() gives them (or as read back from json)"""
+        endpoint = EndpointResult(target and sys.intern(target), scanned_at=scanned_at)
+        chain = []
+        for idx in sorted(results['certs'], key=int):
+            details = results['certs'][idx]
+            # extensions are strings; anything else that is not a cert detail is per connection
+            extra = {key: value for key, value in details.items()
+                if key not in main.CERT_BASIC_FIELDS and key not in ENTRY_FIELDS and not isinstance(value, str)}
+            cert = self.get_cert({key: value for key, value in details.items() if key not in ENTRY_FIELDS and key not in extra})
+            validation = details.get('validation')
+            chain.append(ChainEntry(cert, validation and sys.intern(validation), details.get('fromServer'), details.get('trusted'), extra or None))
+        endpoint.chain = tuple(chain)
+        extra = {}
+        for key, value in results.items():
+            if key == 'certs':
+                continue
+            elif key == 'cafile':
+                endpoint.cafile = intern(value)
+            elif key == 'timing':
+                endpoint.timing_keys = self.share(tuple(value))
+                endpoint.timing = tuple(value.values())
+            elif key == 'connection' and set(value) <= set(CONNECTION_FIELDS):
+                for name, field in value.items():
+                    if name == 'servername' and field == value.get('hostname'):
+                        field = value['hostname']
+                    setattr(endpoint, name, intern(field) if name in ('cipher', 'protocol', 'servername', 'hostname') else field)
+            else:
+                extra[key] = value
+        endpoint.extra = extra or None
+        self.endpoints.append(endpoint)
+        return endpoint
+
+    def add_record(self, record: dict):
+        """Add a line of the main.py -b output"""
+        if 'error' in record:
+            endpoint = EndpointResult(record.get('target'), record['error'], record.get('scanned_at'))
+            self.endpoints.append(endpoint)
+            return endpoint
+        return self.add(record['results'], record.get('target'), record.get('scanned_at'))
+
+    def load(self, stream):
+        """Add every line of main.py -b output from a file-like object"""
+        for line in stream:
+            if line.strip():
+                self.add_record(json.loads(line))
+        return self
+
+def cli():
+    import argparse
+    parser = argparse.ArgumentParser(description='Load the output of a bulk scan into a compact inventory')
+    parser.add_argument('file', help='main.py -b output ("-" for stdin)')
+    args = parser.parse_args()
+
+    inventory = Inventory()
+    if args.file == '-':
+        inventory.load(sys.stdin)
+    else:
+        with open(args.file, "r", encoding="utf8") as f:
+            inventory.load(f)
+    errors = sum(1 for endpoint in inventory if endpoint.error is not None)
+    print(f"{len(inventory)} endpoints ({errors} errors), {len(inventory.certs)} distinct certs")
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,342 @@
+"""
+Revocation checking for the certs of a chain, used by main.process(check_revocation=True).
+
+For each cert, the first of these that gives an answer is used:
+    stapled  the OCSP response the server stapled to the handshake (leaf cert only)
+    ocsp     a request to the OCSP responder in the cert's Authority Information Access
+    crl      the CRL from the cert's CRL Distribution Points
+
+Setting OCSP_URL or CRL_URL sends every request to that URL instead, eg. a local responder for
+testing.  Fetched OCSP responses and CRLs are cached until their nextUpdate, and concurrent
+lookups of the same one wait for a single fetch, so a bulk scan of thousands of leaves under the
+same CA fetches its CRL once.  Each CRL is indexed by serial number, sorted, for bisect lookups.
+"""
+
+import os
+import time
+import bisect
+import datetime
+import threading
+import collections
+import urllib.request
+from cryptography import x509
+from cryptography.x509 import ocsp
+from cryptography.x509.oid import AuthorityInformationAccessOID, ExtendedKeyUsageOID
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa, ec
+from cryptography.exceptions import InvalidSignature
+
+OCSP_URL=os.environ.get("OCSP_URL")   # send every OCSP request here instead of the cert's responder
+CRL_URL=os.environ.get("CRL_URL")     # fetch every CRL from here instead of the cert's distribution point
+REVOCATION_TIMEOUT=5                  # seconds for each fetch, or less if the scan's deadline is nearer
+REVOCATION_CACHE_SIZE=4096
+REVOCATION_DEFAULT_TTL=3600           # seconds to keep a response that has no nextUpdate
+REVOCATION_ERROR_TTL=60               # seconds to remember a failed fetch, rather than retry it for every cert
+
+class OutOfTime(Exception):
+    """The deadline passed before a fetch could start; not cached, unlike a failed fetch"""
+
+class ResponseCache:
+    """OCSP responses and CRLs, each kept until it expires (its nextUpdate)
+    Only one thread fetches a given key at a time; the others wait for it and
+    use its result.  A failed fetch is remembered for REVOCATION_ERROR_TTL
+    seconds, and its error raised again for lookups in that time.
+    """
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.data = collections.OrderedDict()  # key -> (expiry time, value)
+        self.lock = threading.Lock()
+        self.fetching = {}                     # key -> lock held while fetching it
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key):
+        with self.lock:
+            try:
+                expires, value = self.data[key]
+            except KeyError:
+                return None
+            if expires <= time.time():
+                del self.data[key]
+                return None
+            self.data.move_to_end(key)
+            return value
+
+    def get(self, key, fetch):
+        """The cached value for key, or the value from fetch(), which returns (value, expiry time)"""
+        value = self.lookup(key)
+        if value is None:
+            with self.lock:
+                fetch_lock = self.fetching.setdefault(key, threading.Lock())
+            with fetch_lock:
+                # another thread may have fetched it while this one waited
+                value = self.lookup(key)
+                if value is None:
+                    with self.lock:
+                        self.misses += 1
+                    try:
+                        try:
+                            value, expires = fetch()
+                        except (OSError, ValueError) as exc:
+                            value, expires = exc, time.time() + REVOCATION_ERROR_TTL
+                        # stored before the fetch lock is dropped, so a thread arriving in between finds it
+                        self.put(key, value, expires)
+                    finally:
+                        with self.lock:
+                            self.fetching.pop(key, None)
+                    if isinstance(value, Exception):
+                        raise value
+                    return value
+        with self.lock:
+            self.hits += 1
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+    def put(self, key, value, expires: float):
+        with self.lock:
+            self.data[key] = (expires, value)
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def info(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.data), 'maxsize': self.maxsize}
+
+response_cache = ResponseCache(REVOCATION_CACHE_SIZE)
+
+class CRLIndex:
+    """The revoked serials of a CRL, sorted for bisect lookups"""
+    def __init__(self, crl):
+        self.entries = sorted(crl, key=lambda revoked: revoked.serial_number)
+        self.serials = [revoked.serial_number for revoked in self.entries]
+        self.this_update = crl.last_update
+        self.next_update = crl.next_update
+
+    def lookup(self, serial: int):
+        """The RevokedCertificate for serial, or None"""
+        idx = bisect.bisect_left(self.serials, serial)
+        if idx < len(self.serials) and self.serials[idx] == serial:
+            return self.entries[idx]
+        return None
+
+def expiry(next_update):
+    """A nextUpdate (naive UTC, or None) as a time.time() value"""
+    if next_update is None:
+        return time.time() + REVOCATION_DEFAULT_TTL
+    return next_update.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+def format_time(timestamp):
+    return timestamp and f"{timestamp.ctime()} GMT"
+
+def signed_by(public_key, signature: bytes, data: bytes, hash_algorithm):
+    """Whether signature over data was made by public_key's private key"""
+    try:
+        if isinstance(public_key, rsa.RSAPublicKey):
+            public_key.verify(signature, data, padding.PKCS1v15(), hash_algorithm)
+        elif isinstance(public_key, ec.EllipticCurvePublicKey):
+            public_key.verify(signature, data, ec.ECDSA(hash_algorithm))
+        else:
+            public_key.verify(signature, data)  # Ed25519 and Ed448
+    except (InvalidSignature, TypeError, ValueError):
+        return False
+    return True
+
+def fetch_timeout(deadline: float = None):
+    """Seconds allowed for a fetch starting now: REVOCATION_TIMEOUT, or what is
+    left until deadline (a time.monotonic() value) if that is less
+    Raises OutOfTime if the deadline has passed.
+    """
+    if deadline is None:
+        return REVOCATION_TIMEOUT
+    left = min(REVOCATION_TIMEOUT, deadline - time.monotonic())
+    if left <= 0:
+        raise OutOfTime("out of time")
+    return left
+
+def fetch(url: str, deadline: float = None, data: bytes = None, content_type: str = None):
+    """The body of a GET, or a POST of data, to url, within fetch_timeout(deadline)"""
+    timeout = fetch_timeout(deadline)
+    request = urllib.request.Request(url, data=data, headers={'Content-Type': content_type} if content_type else {})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.read()
+    except OSError as exc:
+        # cut short by the deadline rather than a slow server, so not a failure to cache
+        if timeout < REVOCATION_TIMEOUT and deadline - time.monotonic() <= 0:
+            raise OutOfTime("out of time") from exc
+        raise
+
+def ocsp_url(cert):
+    """The OCSP responder of a cert, or None"""
+    if OCSP_URL:
+        return OCSP_URL
+    try:
+        aia = cert.extensions.get_extension_for_class(x509.AuthorityInformationAccess).value
+    except x509.ExtensionNotFound:
+        return None
+    for description in aia:
+        if description.access_method == AuthorityInformationAccessOID.OCSP:
+            return description.access_location.value
+    return None
+
+def crl_url(cert):
+    """The first http CRL distribution point of a cert, or None"""
+    if CRL_URL:
+        return CRL_URL
+    try:
+        points = cert.extensions.get_extension_for_class(x509.CRLDistributionPoints).value
+    except x509.ExtensionNotFound:
+        return None
+    for point in points:
+        for name in point.full_name or []:
+            if isinstance(name, x509.UniformResourceIdentifier) and name.value.startswith("http"):
+                return name.value
+    return None
+
+def ocsp_status(der: bytes, cert, issuer):
+    """The status of cert from a DER encoded OCSP response
+    Raises ValueError if the response is not a good one for this cert, or is not
+    signed by its issuer or a responder the issuer delegated to.
+    """
+    response = ocsp.load_der_ocsp_response(der)
+    if response.response_status != ocsp.OCSPResponseStatus.SUCCESSFUL:
+        raise ValueError(f"OCSP response status {response.response_status.name}")
+
+    # the cert id, as a request for this cert would have it
+    request = ocsp.OCSPRequestBuilder().add_certificate(cert, issuer, response.hash_algorithm).build()
+    if response.serial_number != cert.serial_number or response.issuer_key_hash != request.issuer_key_hash:
+        raise ValueError("OCSP response is for a different certificate")
+
+    signer = issuer
+    if not signed_by(issuer.public_key(), response.signature, response.tbs_response_bytes, response.signature_hash_algorithm):
+        # a delegated responder, whose cert comes with the response
+        for responder in response.certificates:
+            try:
+                ocsp_signing = ExtendedKeyUsageOID.OCSP_SIGNING in responder.extensions.get_extension_for_class(x509.ExtendedKeyUsage).value
+            except x509.ExtensionNotFound:
+                ocsp_signing = False
+            if ocsp_signing and signed_by(issuer.public_key(), responder.signature, responder.tbs_certificate_bytes, responder.signature_hash_algorithm) \
+                    and signed_by(responder.public_key(), response.signature, response.tbs_response_bytes, response.signature_hash_algorithm):
+                signer = responder
+                break
+        else:
+            raise ValueError("OCSP response signature does not verify")
+
+    if response.next_update and expiry(response.next_update) < time.time():
+        raise ValueError("OCSP response has expired")
+
+    status = {
+        'status': response.certificate_status.name.lower(),
+        'thisUpdate': format_time(response.this_update),
+        'nextUpdate': format_time(response.next_update),
+    }
+    if signer is not issuer:
+        status['responder'] = signer.subject.rfc4514_string()
+    if response.certificate_status == ocsp.OCSPCertStatus.REVOKED:
+        status['revokedAt'] = format_time(response.revocation_time)
+        if response.revocation_reason:
+            status['reason'] = response.revocation_reason.name
+    return status
+
+def ocsp_lookup(url: str, cert, issuer, deadline: float = None):
+    """The status of cert from its OCSP responder, cached until the response's nextUpdate"""
+    request = ocsp.OCSPRequestBuilder().add_certificate(cert, issuer, hashes.SHA1()).build()
+
+    def fetch_response():
+        der = fetch(url, deadline, request.public_bytes(serialization.Encoding.DER), 'application/ocsp-request')
+        status = ocsp_status(der, cert, issuer)
+        return status, expiry(ocsp.load_der_ocsp_response(der).next_update)
+
+    return dict(response_cache.get(('ocsp', url, request.issuer_key_hash, cert.serial_number), fetch_response))
+
+def crl_lookup(url: str, cert, issuer, deadline: float = None):
+    """The status of cert from its CRL, cached (and indexed) until the CRL's nextUpdate"""
+    def fetch_crl():
+        contents = fetch(url, deadline)
+        if contents.lstrip().startswith(b'-----BEGIN'):
+            crl = x509.load_pem_x509_crl(contents)
+        else:
+            crl = x509.load_der_x509_crl(contents)
+        if crl.issuer != issuer.subject or not crl.is_signature_valid(issuer.public_key()):
+            raise ValueError(f"CRL from {url} is not signed by the issuer")
+        return CRLIndex(crl), expiry(crl.next_update)
+
+    index = response_cache.get(('crl', url, issuer.subject.rfc4514_string()), fetch_crl)
+    if index.next_update and expiry(index.next_update) < time.time():
+        raise ValueError("CRL has expired")
+    status = {
+        'status': 'good',
+        'thisUpdate': format_time(index.this_update),
+        'nextUpdate': format_time(index.next_update),
+    }
+    revoked = index.lookup(cert.serial_number)
+    if revoked:
+        status['status'] = 'revoked'
+        status['revokedAt'] = format_time(revoked.revocation_date)
+        try:
+            status['reason'] = revoked.extensions.get_extension_for_class(x509.CRLReason).value.reason.name
+        except x509.ExtensionNotFound:
+            pass
+    return status
+
+def check_cert(cert, issuer, staple: bytes = None, deadline: float = None):
+    """The revocation status of a cert (cryptography x509.Certificate objects)
+    Each fetch is limited to REVOCATION_TIMEOUT, and to what is left until
+    deadline (a time.monotonic() value); once it has passed, no more sources are
+    tried.  Returns a dict with 'status' (good, revoked or unknown) and 'source',
+    plus 'errors' for any sources that were tried and failed.
+    """
+    errors = []
+    sources = []
+    if staple:
+        sources.append(('stapled', lambda: ocsp_status(staple, cert, issuer)))
+    url = ocsp_url(cert)
+    if url:
+        sources.append(('ocsp', lambda: ocsp_lookup(url, cert, issuer, deadline)))
+    url_crl = crl_url(cert)
+    if url_crl:
+        sources.append(('crl', lambda: crl_lookup(url_crl, cert, issuer, deadline)))
+
+    for source, lookup in sources:
+        try:
+            status = lookup()
+        except OutOfTime as exc:
+            errors.append(f"{source}: {exc}")
+            break
+        except (OSError, ValueError) as exc:
+            errors.append(f"{source}: {exc}")
+            continue
+        if status['status'] == 'unknown':
+            errors.append(f"{source}: unknown")
+            continue
+        status['source'] = source
+        if errors:
+            status['errors'] = errors
+        return status
+
+    if not sources:
+        errors.append("no OCSP responder or CRL distribution point")
+    return {'status': 'unknown', 'errors': errors}
+
+def check_chain(chain, issuers, staple: bytes = None, deadline: float = None):
+    """The revocation status of each cert in chain (pyOpenSSL X509 objects)
+    issuers is the issuer of each cert, or None where it is not known.  staple
+    is the OCSP response stapled to the handshake, which is for the leaf.
+    deadline (a time.monotonic() value) bounds the fetches for the whole chain,
+    see check_cert().
+    Returns a list with a dict from check_cert() for each cert, or None for certs
+    that cannot be checked (self-signed, or with no issuer).
+    """
+    statuses = []
+    for idx, (cert, issuer) in enumerate(zip(chain, issuers)):
+        cert = cert.to_cryptography()
+        if issuer is None or cert.issuer == cert.subject:
+            statuses.append(None)
+            continue
+        statuses.append(check_cert(cert, issuer.to_cryptography(), staple if idx == 0 else None, deadline))
+    return statuses
@@ -10,8 +10,16 @@ import json
 import base64 
 import sys
 import re 
+import time
+import collections
 from botocore.exceptions import ClientError
 
+# Total size of the response bodies kept in memory by a warm container, and the largest one kept
+RESPONSE_CACHE_BYTES = int(os.environ.get("RESPONSE_CACHE_BYTES", 64 * 1024 * 1024))
+RESPONSE_CACHE_MAX_ITEM = RESPONSE_CACHE_BYTES // 8
+
+TEXT_TYPES = ["text/html","text/css","application/javascript","application/json","image/svg+xml"]
+
 # Example CONFIG value
 CONFIG = """{
   "path": {
@@ -42,20 +50,108 @@ for path, target in configdata["path"].items():
     b_path = result.group(2)
     configdata["path"][path] = {"bucket": bucket, "bucket_path": b_path}
 
+class PrefixMap:
+    """Longest-prefix lookups in a dict of path prefix -> value
+    Rather than trying each prefix in turn, try the request's own prefixes of
+    each length a key has, longest first, so the order of the config does not
+    matter.
+    """
+    def __init__(self, mapping):
+        self.mapping = dict(mapping)
+        self.lengths = sorted({len(prefix) for prefix in self.mapping}, reverse=True)
+
+    def match(self, path):
+        """The longest prefix of path that is a key, and its value, or None, None"""
+        for length in self.lengths:
+            if length <= len(path) and path[:length] in self.mapping:
+                return path[:length], self.mapping[path[:length]]
+        return None, None
+
+configdata["path_map"] = PrefixMap(configdata["path"])
+configdata["cache_map"] = PrefixMap(configdata.get("cache", {}))
+
 def get_bucket_and_bucket_file(file, configdata):
     """Given the input file request, return the bucket and mapping for the stored file"""
-    for path, target in configdata["path"].items():
-        if file.startswith(path):
-            return target["bucket"], f'{target["bucket_path"]}{file[len(path):]}'
+    path, target = configdata["path_map"].match(file)
+    if target:
+        return target["bucket"], f'{target["bucket_path"]}{file[len(path):]}'
     return None, None
 
+def get_cache_seconds(file, configdata):
+    """Given the input file request, return the seconds the browser may cache it, if any"""
+    return configdata["cache_map"].match(file)[1]
+
 def get_cache_header(file, configdata):
     """Given the input file request, return the cache-control header value, if any"""
-    for path, cache_seconds in configdata["cache"].items():
-        if file.startswith(path):
-            return f"max-age={cache_seconds}"
+    cache_seconds = get_cache_seconds(file, configdata)
+    if cache_seconds is not None:
+        return f"max-age={cache_seconds}"
     return None
 
+class ResponseCache:
+    """Prepared lambda responses, by (bucket, key), bounded by the total size of their bodies
+    Each entry is served as is until its max-age is up, then revalidated
+    against S3 with its ETag.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.data = collections.OrderedDict()  # (bucket, key) -> entry dict
+
+    def get(self, key):
+        entry = self.data.get(key)
+        if entry:
+            self.data.move_to_end(key)
+        return entry
+
+    def put(self, key, entry):
+        self.discard(key)
+        if entry["size"] > RESPONSE_CACHE_MAX_ITEM:
+            return
+        self.data[key] = entry
+        self.bytes += entry["size"]
+        while self.bytes > self.max_bytes:
+            old_key, old_entry = self.data.popitem(last=False)
+            self.bytes -= old_entry["size"]
+
+    def discard(self, key):
+        entry = self.data.pop(key, None)
+        if entry:
+            self.bytes -= entry["size"]
+
+response_cache = ResponseCache(RESPONSE_CACHE_BYTES)
+
+def prepare_response(s3_response, cache_header):
+    """The lambda response for an S3 get_object response"""
+    # Start the headers dict
+    headers = {"Content-Type": s3_response["ContentType"]}
+
+    # Add cache header, if any
+    if cache_header:
+        headers["Cache-Control"] = cache_header
+
+    # Return the text objects
+    if s3_response["ContentType"] in TEXT_TYPES:
+        return {
+            "statusCode": 200,
+            "isBase64Encoded": False,
+            "headers": headers,
+            "body": s3_response["Body"].read().decode("utf-8")
+        }
+    # Return the binary objects
+    else:
+        headers["Content-Encoding"] = "base64"
+        return {
+            "statusCode": 200,
+            "isBase64Encoded": True,
+            "headers": headers,
+            "body": base64.b64encode(s3_response["Body"].read()).decode("utf-8")
+        }
+
+def not_modified(e):
+    """Whether a ClientError from get_object(IfNoneMatch=...) means the object has not changed"""
+    return e.response.get("Error", {}).get("Code") in ("304", "NotModified")
+
 s3 = boto3.client('s3')
 
 def lambda_handler(event, context):
@@ -80,10 +176,26 @@ def lambda_handler(event, context):
     if bucket_file.startswith("/"):
         # remove leading slash
         bucket_file = bucket_file[1:]
-    
+
+    cache_seconds = get_cache_seconds(file, configdata)
+    cache_header = get_cache_header(file, configdata)
+    key = (bucket, bucket_file)
+    entry = response_cache.get(key)
+    if entry and entry["fresh_until"] > time.monotonic():
+        # served from memory, without touching S3
+        return dict(entry["response"], headers=dict(entry["response"]["headers"]))
+
     try:
-        response = s3.get_object(Bucket=bucket, Key=bucket_file)
+        if entry and entry["etag"]:
+            # expired; only fetch it again if it has changed
+            response = s3.get_object(Bucket=bucket, Key=bucket_file, IfNoneMatch=entry["etag"])
+        else:
+            response = s3.get_object(Bucket=bucket, Key=bucket_file)
     except ClientError as e:
+        if entry and not_modified(e):
+            entry["fresh_until"] = time.monotonic() + (cache_seconds or 0)
+            return dict(entry["response"], headers=dict(entry["response"]["headers"]))
+        response_cache.discard(key)
         body = f"404 not found: {file}"
         if os.environ.get("DEBUG"):
             body = f"404 not found: {file} - (no s3://{bucket}/{bucket_file}) - {e}"
@@ -93,32 +205,15 @@ def lambda_handler(event, context):
             "body": body
         }
     
-    # Start the headers dict
-    headers = {"Content-Type": response["ContentType"]}
+    prepared = prepare_response(response, cache_header)
+    response_cache.put(key, {
+        "response": prepared,
+        "etag": response.get("ETag"),
+        "size": len(prepared["body"]),
+        "fresh_until": time.monotonic() + (cache_seconds or 0)
+    })
+    return dict(prepared, headers=dict(prepared["headers"]))
 
-    # Add cache header, if any
-    cache_header = get_cache_header(file, configdata)
-    if cache_header:
-        headers["Cache-Control"] = cache_header
-    
-    # Return the text objects
-    if response["ContentType"] in ["text/html","text/css","application/javascript","application/json","image/svg+xml"]:
-        return {
-            "statusCode": 200,
-            "isBase64Encoded": False,
-            "headers": headers,
-            "body": response["Body"].read().decode("utf-8")
-        }
-    # Return the binary objects
-    else:
-        headers["Content-Encoding"] = "base64"
-        return {
-            "statusCode": 200,
-            "isBase64Encoded": True,
-            "headers": headers,
-            "body": base64.b64encode(response["Body"].read()).decode("utf-8")
-        }
-    
 if __name__ == "__main__":
     # Running from command line
     # os.environ["AWS_PROFILE"] = "yourprofilename"